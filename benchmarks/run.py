@@ -0,0 +1,286 @@
+"""
+Benchmarks for the hot paths of string phone.
+
+This is a standalone runner that needs nothing beyond the library itself. Run
+it from the root of the repository:
+
+    python benchmarks/run.py --output results.json
+
+Results are written as JSON, with one entry per benchmark, so that runs from
+different releases can be compared with `--compare`.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import stringphone  # noqa
+from stringphone import metadata  # noqa
+from stringphone import Message, Topic  # noqa
+from stringphone.backends import available_backends, select_backend  # noqa
+from stringphone.crypto import (  # noqa
+    BufferedNonceSource, CounterNonceSource, NonceSource,
+    SymmetricCrypto, Signer, Verifier, generate_signing_key_seed
+)
+
+PAYLOAD_SIZES = [0, 64, 1024, 64 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+QUICK_PAYLOAD_SIZES = [0, 64, 1024, 64 * 1024]
+
+
+def measure(function, repeat, min_time):
+    """
+    Time `function` and return the best and median time per call, in seconds.
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    timings = sorted(t / number for t in timer.repeat(repeat, number))
+    return {
+        "calls": number,
+        "best": timings[0],
+        "median": timings[len(timings) // 2],
+    }
+
+
+class _Topics(object):
+    """
+    The topics the benchmarks encode and decode with.
+    """
+
+    def __init__(self):
+        self.topic_key = topic_key = stringphone.generate_topic_key()
+        self.master = Topic(topic_key=topic_key)
+        self.slave = Topic(topic_key=topic_key)
+        self.master.add_participant(self.slave.public_key)
+        self.mac_master = Topic(topic_key=topic_key, mac_authentication=True)
+        self.mac_slave = Topic(topic_key=topic_key, mac_authentication=True)
+        self.mac_master.add_participant(self.mac_slave.public_key)
+        self.counter_slave = Topic(
+            topic_key=topic_key, mac_authentication=True,
+            nonce_source=CounterNonceSource(),
+        )
+
+
+def benchmarks(sizes):
+    """
+    Yield (name, parameters, setup) tuples for every benchmark.
+
+    `setup` builds the inputs of the benchmark and returns the function to
+    time, so that the (sometimes large) inputs are only built for the
+    benchmarks that are run.
+    """
+    topics = _Topics()
+    groups = [
+        _key_benchmarks(topics),
+        _backend_benchmarks(topics),
+        _nonce_benchmarks(),
+        _discovery_benchmarks(topics),
+    ]
+    groups.extend(_payload_benchmarks(topics, size) for size in sizes)
+    return itertools.chain.from_iterable(groups)
+
+
+def _key_benchmarks(topics):
+    topic_key = topics.topic_key
+    yield "generate_topic_key", {}, lambda: stringphone.generate_topic_key
+    yield "generate_signing_key_seed", {}, lambda: generate_signing_key_seed
+    yield "topic_init", {}, lambda: lambda: Topic(topic_key=topic_key)
+
+
+def _backend_benchmarks(topics):
+    topic_key = topics.topic_key
+    yield "backend_selection", {}, lambda: select_backend
+    for backend in available_backends():
+        parameters = {"backend": backend.name}
+
+        def backend_sign(backend=backend):
+            signer = Signer(generate_signing_key_seed(), backend=backend)
+            return lambda: signer.sign(b"\x00" * 64)
+
+        def backend_verify(backend=backend):
+            signer = Signer(generate_signing_key_seed(), backend=backend)
+            verifier = Verifier(signer.public_key, backend=backend)
+            signed = signer.sign(b"\x00" * 64)
+            return lambda: verifier.verify(signed)
+
+        def backend_encrypt(backend=backend):
+            symmetric = SymmetricCrypto(topic_key, backend=backend)
+            return lambda: symmetric.encrypt(b"\x00" * 64)
+
+        def backend_decrypt(backend=backend):
+            symmetric = SymmetricCrypto(topic_key, backend=backend)
+            ciphertext = symmetric.encrypt(b"\x00" * 64)
+            return lambda: symmetric.decrypt(ciphertext)
+
+        yield "backend_sign", parameters, backend_sign
+        yield "backend_verify", parameters, backend_verify
+        yield "backend_encrypt", parameters, backend_encrypt
+        yield "backend_decrypt", parameters, backend_decrypt
+
+
+def _nonce_benchmarks():
+    yield "nonce_random", {}, lambda: NonceSource().nonce
+    yield "nonce_buffered", {}, lambda: BufferedNonceSource().nonce
+    yield "nonce_counter", {}, lambda: CounterNonceSource().nonce
+
+
+def _discovery_benchmarks(topics):
+    master = topics.master
+    slave = topics.slave
+
+    def parse_reply():
+        newcomer = Topic()
+        newcomer_reply = master.construct_reply(newcomer.construct_intro())
+
+        def run():
+            newcomer.topic_key = None
+            newcomer.parse_reply(newcomer_reply)
+        return run
+
+    def construct_reply():
+        intro = slave.construct_intro()
+        return lambda: master.construct_reply(intro)
+
+    def message_fields_reply():
+        reply = master.construct_reply(slave.construct_intro())
+        return lambda: (Message(reply).recipient_id, Message(reply).sender_id)
+
+    yield "construct_intro", {}, lambda: slave.construct_intro
+    yield "construct_reply", {}, construct_reply
+    yield "parse_reply", {}, parse_reply
+    yield "message_fields_reply", {}, message_fields_reply
+
+
+def _payload_benchmarks(topics, size):
+    parameters = {"size": size}
+    master = topics.master
+    slave = topics.slave
+
+    def encode(topic=slave):
+        payload = os.urandom(size)
+        return lambda: topic.encode(payload)
+
+    def encode_many(batch_sign=False):
+        payloads = [os.urandom(size)] * 100
+        return lambda: slave.encode_many(payloads, batch_sign=batch_sign)
+
+    def decode(naive=False):
+        encoded = slave.encode(os.urandom(size))
+        return lambda: master.decode(encoded, naive=naive)
+
+    def decode_mac():
+        encoded = topics.mac_slave.encode(os.urandom(size))
+        return lambda: topics.mac_master.decode(encoded)
+
+    def decode_many():
+        batch = [slave.encode(os.urandom(size))] * 100
+        return lambda: master.decode_many(batch)
+
+    def decode_many_batch_signed():
+        batch = slave.encode_many([os.urandom(size)] * 100, batch_sign=True)
+
+        def run():
+            # Forget the verified root, so every run verifies the signature.
+            master._roots.clear()
+            master.decode_many(batch)
+        return run
+
+    def message_fields():
+        encoded = slave.encode(os.urandom(size))
+        return lambda: (
+            Message(encoded).sender_id, Message(encoded).ciphertext
+        )
+
+    yield "encode", parameters, encode
+    yield "encode_many_100", parameters, encode_many
+    yield "decode_naive", parameters, lambda: decode(naive=True)
+    yield "decode_verified", parameters, decode
+    yield "encode_mac", parameters, lambda: encode(topics.mac_slave)
+    yield "decode_mac", parameters, decode_mac
+    yield "encode_mac_counter_nonces", parameters, (
+        lambda: encode(topics.counter_slave)
+    )
+    yield "decode_many_100", parameters, decode_many
+    yield "encode_many_100_batch_signed", parameters, (
+        lambda: encode_many(batch_sign=True)
+    )
+    yield "decode_many_100_batch_signed", parameters, (
+        decode_many_batch_signed
+    )
+    yield "message_fields", parameters, message_fields
+
+
+def compare(old_path, results):
+    """
+    Print the relative change of every benchmark against a previous run.
+    """
+    with open(old_path) as infile:
+        old = {
+            (r["name"], json.dumps(r["parameters"], sort_keys=True)): r
+            for r in json.load(infile)["results"]
+        }
+    for result in results:
+        key = (result["name"], json.dumps(result["parameters"], sort_keys=True))
+        if key not in old:
+            continue
+        change = result["median"] / old[key]["median"] - 1
+        print("%-28s %-16s %+7.1f%%" % (
+            result["name"], key[1], change * 100
+        ), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--output", help="The file to write the JSON results to."
+    )
+    parser.add_argument(
+        "--compare", help="A previous JSON results file to compare against."
+    )
+    parser.add_argument(
+        "--filter", default="", help="Only run benchmarks containing this."
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Skip the largest payloads."
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.1)
+    args = parser.parse_args()
+
+    sizes = QUICK_PAYLOAD_SIZES if args.quick else PAYLOAD_SIZES
+    results = []
+    for name, parameters, setup in benchmarks(sizes):
+        if args.filter not in name:
+            continue
+        result = {"name": name, "parameters": parameters}
+        result.update(measure(setup(), args.repeat, args.min_time))
+        results.append(result)
+        print("%-28s %-16s %12.2f us" % (
+            name, json.dumps(parameters), result["median"] * 1e6
+        ), file=sys.stderr)
+
+    output = {
+        "version": metadata.version,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(output, outfile, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
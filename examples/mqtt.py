@@ -2,6 +2,7 @@ import sys
 
 import codecs
 import stringphone
+import stringphone.framing
 import paho.mqtt.client as mqtt
 
 TOPIC_NAME = "stringphone"
@@ -11,7 +12,7 @@ def send(client, message):
     """
     A simple convenience function to avoid repetition.
     """
-    client.publish(TOPIC_NAME, bytearray(codecs.encode(message, "hex")))
+    client.publish(TOPIC_NAME, stringphone.framing.encode_frame(message))
 
 
 def on_connect(client, userdata, flags, rc):
@@ -31,8 +32,8 @@ def on_message(client, userdata, msg):
     """
     The operations to perform on receiving a new message.
     """
-    # Decode the payload.
-    payload = codecs.decode(msg.payload, "hex")
+    # Unwrap the payload.
+    payload = stringphone.framing.decode_frame(msg.payload).tobytes()
     try:
         # Try to decode the message.
         message = topic.decode(payload)
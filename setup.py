@@ -255,6 +255,10 @@ setup_dict = dict(
         "pynacl",
         "hypothesis",
     ] + python_version_specific_requires,
+    extras_require={
+        "zstd": ["zstandard"],
+        "cryptography": ["cryptography"],
+    },
     # Allow tests to be run with `python setup.py test'.
     tests_require=[
         'pytest',
@@ -1,3 +1,4 @@
 # flake8: noqa
 from .crypto import generate_signing_key_seed, generate_topic_key
-from .topic import Topic, Message
+from .topic import Topic, Message, MessageView, StreamDecoder
+from .manager import TopicManager
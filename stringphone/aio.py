@@ -0,0 +1,181 @@
+"""
+An asyncio interface to topics, which runs the cryptography in an executor so
+that the event loop is never blocked.
+
+This module requires Python 3.7 or later.
+"""
+import asyncio
+import functools
+import inspect
+
+import nacl.exceptions
+
+from .exceptions import (
+    BadSignatureError, IntroductionError, IntroductionReplyError,
+    MalformedMessageError
+)
+from .topic import _as_message
+
+
+async def _call(handler, *args):
+    """
+    Call a handler that may be either a coroutine function or a plain
+    function.
+    """
+    result = handler(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class AsyncTopic(object):
+    """
+    An asyncio wrapper around a `Topic <stringphone.topic.Topic>`.
+
+    All the cryptographic operations run in an executor, so many topics can be
+    served concurrently from a single event loop. By default, this is the
+    loop's default executor, which is a thread pool. The underlying libsodium
+    calls release the GIL, so this lets them run in parallel.
+    """
+
+    def __init__(self, topic, executor=None):
+        """
+        :param Topic topic: The topic to wrap.
+        :param concurrent.futures.Executor executor: The optional executor to
+            run the cryptographic operations in. If this is not provided, the
+            event loop's default executor is used.
+        """
+        self.topic = topic
+        self._executor = executor
+
+    async def _run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(function, *args, **kwargs)
+        )
+
+    async def encode(self, message):
+        """
+        Encode a message for transmission. See `Topic.encode
+        <stringphone.topic.Topic.encode>`.
+
+        :param bytes message: The plaintext to encode.
+        :rtype: bytes
+        """
+        return await self._run(self.topic.encode, message)
+
+    async def decode(self, message, naive=False, ignore_untrusted=False):
+        """
+        Decode a message. See `Topic.decode <stringphone.topic.Topic.decode>`.
+
+        :param bytes message: The raw message from the channel.
+        :rtype: bytes
+        """
+        return await self._run(
+            self.topic.decode, message, naive=naive,
+            ignore_untrusted=ignore_untrusted
+        )
+
+    async def construct_reply(self, message):
+        """
+        Generate a reply to an introduction. See `Topic.construct_reply
+        <stringphone.topic.Topic.construct_reply>`.
+
+        :param bytes message: The raw introduction message from the channel.
+        :rtype: bytes
+        """
+        return await self._run(self.topic.construct_reply, message)
+
+    async def construct_reply_batch(self, messages):
+        """
+        Generate a single reply to many introductions. See
+        `Topic.construct_reply_batch
+        <stringphone.topic.Topic.construct_reply_batch>`.
+
+        :param messages: The raw introduction messages from the channel.
+        :rtype: bytes
+        """
+        return await self._run(
+            self.topic.construct_reply_batch, list(messages)
+        )
+
+    async def parse_reply(self, message):
+        """
+        Decode the reply to an introduction. See `Topic.parse_reply
+        <stringphone.topic.Topic.parse_reply>`.
+
+        :param bytes message: The raw reply message from the channel.
+        :rtype: bool
+        """
+        return await self._run(self.topic.parse_reply, message)
+
+    async def run(
+        self,
+        messages,
+        on_message,
+        on_intro=None,
+        on_reply=None,
+        on_error=None,
+        naive=False,
+        ignore_untrusted=False
+    ):
+        """
+        Consume messages from an asynchronous iterator and dispatch them to
+        handlers, until the iterator is exhausted.
+
+        Messages are decoded one at a time, in the order they arrive. Handlers
+        may be either coroutine functions or plain functions.
+
+        :param messages: An asynchronous iterable of raw messages.
+        :param on_message: Called with the plaintext of every decoded message.
+        :param on_intro: Called with the parsed `Message` of every
+            introduction. If this is not provided, introductions are ignored.
+        :param on_reply: Called with the parsed `Message` of every
+            introduction reply. If this is not provided, replies are parsed
+            with `parse_reply`.
+        :param on_error: Called with the raw message and the exception for
+            every message that could not be decoded or, when `on_reply` is not
+            provided, every reply that could not be parsed. If this is not
+            provided, the exception is raised.
+        :param bool naive: If `True`, signature verification **IS NOT
+            PERFORMED**. Use at your own risk.
+        :param bool ignore_untrusted: If `True`, messages from unknown
+            participants will be silently ignored.
+        """
+        async for raw in messages:
+            result = (await self._run(
+                self.topic.decode_many, [raw], naive=naive,
+                ignore_untrusted=ignore_untrusted
+            ))[0]
+
+            if result is None:
+                continue
+            elif isinstance(result, IntroductionError):
+                if on_intro is not None:
+                    await _call(on_intro, _as_message(raw))
+            elif isinstance(result, IntroductionReplyError):
+                await self._handle_reply(raw, on_reply, on_error)
+            elif isinstance(result, Exception):
+                if on_error is None:
+                    raise result
+                await _call(on_error, raw, result)
+            else:
+                await _call(on_message, result)
+
+    async def _handle_reply(self, raw, on_reply, on_error):
+        """
+        Hand an introduction reply to `on_reply`, or parse it if that is not
+        provided, reporting parsing failures to `on_error`.
+        """
+        if on_reply is not None:
+            await _call(on_reply, _as_message(raw))
+            return
+        try:
+            await self.parse_reply(raw)
+        except (
+            BadSignatureError, MalformedMessageError,
+            nacl.exceptions.CryptoError
+        ) as e:
+            if on_error is None:
+                raise
+            await _call(on_error, raw, e)
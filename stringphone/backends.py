@@ -0,0 +1,418 @@
+"""
+Implementations of the cryptographic primitives that messages are signed and
+encrypted with.
+
+Every backend produces exactly the same Ed25519 signatures and
+XSalsa20-Poly1305 secret boxes, so the choice of backend only affects speed,
+and participants using different backends can talk to each other. The
+backends are:
+
+* "nacl", which uses PyNaCl and is always available.
+* "libsodium", which calls the system's libsodium directly through ctypes,
+  if it is installed.
+* "cryptography", which signs and verifies with OpenSSL through the
+  `cryptography` package, if it is installed. OpenSSL has no XSalsa20, so
+  this backend encrypts with PyNaCl.
+
+Unless one is chosen with :py:func:`set_backend`, the backend is chosen the
+first time it's needed, by timing a short workload on every available backend.
+A backend is only preferred over the ones listed before it if it is clearly
+faster, so that timing noise doesn't make the choice vary between processes.
+"""
+import ctypes
+import ctypes.util
+import threading
+import timeit
+
+import nacl.bindings
+import nacl.exceptions
+import six
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+except ImportError:
+    ed25519 = None
+
+from .exceptions import BadSignatureError
+
+SIGNATURE_LENGTH = 64
+_KEY_LENGTH = 32
+_NONCE_LENGTH = 24
+_MAC_LENGTH = 16
+
+# The number of times the selection workload is run on each backend, and how
+# many of those runs are timed.
+_SELECTION_NUMBER = 10
+_SELECTION_REPEAT = 5
+
+# How much faster a backend has to be than the ones before it to be chosen.
+_SELECTION_MARGIN = 0.1
+
+# The exceptions that mean a backend doesn't work on this system.
+_BACKEND_ERRORS = (
+    nacl.exceptions.CryptoError, BadSignatureError, OSError,
+    ctypes.ArgumentError,
+)
+
+_backend = None
+_lock = threading.Lock()
+
+
+class Backend(object):
+    """
+    The interface that backends implement. Keys are converted to the
+    backend's own representation once, with the `*_key` methods, and the
+    result is passed to the operations that use them.
+
+    This one uses PyNaCl.
+    """
+
+    name = "nacl"
+
+    def signing_key(self, seed):
+        """
+        Prepare a private signing key.
+
+        :param bytes seed: The 32-byte seed of the key.
+        """
+        return nacl.bindings.crypto_sign_seed_keypair(seed)[1]
+
+    def public_key(self, signing_key):
+        """
+        Return the public key of a prepared private signing key.
+
+        :param signing_key: The prepared private key.
+        :rtype: bytes
+        """
+        # The expanded secret key is the seed followed by the public key.
+        return signing_key[_KEY_LENGTH:]
+
+    def verify_key(self, public_key):
+        """
+        Prepare a public signing key.
+
+        :param bytes public_key: The 32-byte public key.
+        :raises nacl.exceptions.ValueError: if the key has the wrong length.
+        """
+        _check_length(public_key, _KEY_LENGTH, "public key")
+        return public_key
+
+    def secret_key(self, key):
+        """
+        Prepare a symmetric key.
+
+        :param bytes key: The 32-byte key.
+        :raises nacl.exceptions.ValueError: if the key has the wrong length.
+        """
+        _check_length(key, _KEY_LENGTH, "key")
+        return key
+
+    def sign(self, signing_key, message):
+        """
+        Sign a message.
+
+        :param signing_key: The prepared private key.
+        :param bytes message: The message.
+        :returns: The signature followed by the message.
+        :rtype: bytes
+        """
+        return nacl.bindings.crypto_sign(message, signing_key)
+
+    def verify(self, verify_key, signed):
+        """
+        Verify a signed message.
+
+        :param verify_key: The prepared public key.
+        :param bytes signed: The signature followed by the message.
+        :returns: The message.
+        :rtype: bytes
+        :raises BadSignatureError: if the signature is invalid.
+        """
+        try:
+            return nacl.bindings.crypto_sign_open(signed, verify_key)
+        except nacl.exceptions.BadSignatureError as e:
+            raise BadSignatureError(str(e))
+
+    def encrypt(self, secret_key, plaintext, nonce):
+        """
+        Encrypt a plaintext into a secret box.
+
+        :param secret_key: The prepared key.
+        :param bytes plaintext: The plaintext.
+        :param bytes nonce: The 24-byte nonce.
+        :returns: The nonce followed by the box.
+        :rtype: bytes
+        """
+        return nonce + nacl.bindings.crypto_secretbox_easy(
+            plaintext, nonce, secret_key
+        )
+
+    def decrypt(self, secret_key, ciphertext):
+        """
+        Open a secret box.
+
+        :param secret_key: The prepared key.
+        :param bytes ciphertext: The nonce followed by the box.
+        :returns: The plaintext.
+        :rtype: bytes
+        :raises nacl.exceptions.CryptoError: if the box is invalid.
+        """
+        if len(ciphertext) < _NONCE_LENGTH + _MAC_LENGTH:
+            raise nacl.exceptions.CryptoError("The ciphertext is too short.")
+        return nacl.bindings.crypto_secretbox_open_easy(
+            ciphertext[_NONCE_LENGTH:], ciphertext[:_NONCE_LENGTH],
+            secret_key
+        )
+
+
+class LibsodiumBackend(Backend):
+    """
+    A backend that calls the system's libsodium through ctypes, which skips
+    the argument checks and conversions of PyNaCl.
+    """
+
+    name = "libsodium"
+
+    def __init__(self, path=None):
+        """
+        :param str path: The path of the library. If this is not provided,
+            it is looked up in the usual places.
+        :raises OSError: if the library can't be loaded.
+        """
+        if path is None:
+            path = ctypes.util.find_library("sodium")
+            if path is None:
+                raise OSError("libsodium was not found.")
+        library = ctypes.CDLL(path)
+        if library.sodium_init() < 0:
+            raise OSError("libsodium could not be initialized.")
+
+        buffer = ctypes.c_char_p
+        length = ctypes.c_ulonglong
+        functions = {
+            "crypto_sign": (
+                buffer, ctypes.c_void_p, buffer, length, buffer
+            ),
+            "crypto_sign_verify_detached": (buffer, buffer, length, buffer),
+            "crypto_secretbox_easy": (buffer, buffer, length, buffer, buffer),
+            "crypto_secretbox_open_easy": (
+                buffer, buffer, length, buffer, buffer
+            ),
+        }
+        for name, argtypes in functions.items():
+            function = getattr(library, name)
+            function.argtypes = argtypes
+            function.restype = ctypes.c_int
+            setattr(self, "_" + name, function)
+
+    def sign(self, signing_key, message):
+        signed = ctypes.create_string_buffer(SIGNATURE_LENGTH + len(message))
+        self._crypto_sign(signed, None, message, len(message), signing_key)
+        return signed.raw
+
+    def verify(self, verify_key, signed):
+        if len(signed) < SIGNATURE_LENGTH:
+            raise BadSignatureError("The signed message is too short.")
+        message = signed[SIGNATURE_LENGTH:]
+        if self._crypto_sign_verify_detached(
+                signed, message, len(message), verify_key):
+            raise BadSignatureError(
+                "Signature was forged or corrupt"
+            )
+        return message
+
+    def encrypt(self, secret_key, plaintext, nonce):
+        box = ctypes.create_string_buffer(_MAC_LENGTH + len(plaintext))
+        self._crypto_secretbox_easy(
+            box, plaintext, len(plaintext), nonce, secret_key
+        )
+        return nonce + box.raw
+
+    def decrypt(self, secret_key, ciphertext):
+        if len(ciphertext) < _NONCE_LENGTH + _MAC_LENGTH:
+            raise nacl.exceptions.CryptoError("The ciphertext is too short.")
+        box = ciphertext[_NONCE_LENGTH:]
+        plaintext = ctypes.create_string_buffer(len(box) - _MAC_LENGTH)
+        # The nonce is read from the start of the ciphertext, which saves
+        # copying it out.
+        if self._crypto_secretbox_open_easy(
+                plaintext, box, len(box), ciphertext, secret_key):
+            raise nacl.exceptions.CryptoError(
+                "Decryption failed. Ciphertext failed verification"
+            )
+        return plaintext.raw
+
+
+class CryptographyBackend(Backend):
+    """
+    A backend that signs and verifies with OpenSSL, through the
+    `cryptography` package. Secret boxes are handled by PyNaCl.
+    """
+
+    name = "cryptography"
+
+    def __init__(self):
+        """
+        :raises ImportError: if `cryptography` is not installed.
+        """
+        if ed25519 is None:
+            raise ImportError("cryptography is not installed.")
+
+    def signing_key(self, seed):
+        _check_length(seed, _KEY_LENGTH, "seed")
+        return ed25519.Ed25519PrivateKey.from_private_bytes(seed)
+
+    def public_key(self, signing_key):
+        return signing_key.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+
+    def verify_key(self, public_key):
+        _check_length(public_key, _KEY_LENGTH, "public key")
+        return ed25519.Ed25519PublicKey.from_public_bytes(public_key)
+
+    def sign(self, signing_key, message):
+        return signing_key.sign(message) + message
+
+    def verify(self, verify_key, signed):
+        if len(signed) < SIGNATURE_LENGTH:
+            raise BadSignatureError("The signed message is too short.")
+        message = signed[SIGNATURE_LENGTH:]
+        try:
+            verify_key.verify(signed[:SIGNATURE_LENGTH], message)
+        except InvalidSignature:
+            raise BadSignatureError("Signature was forged or corrupt")
+        return message
+
+
+def _check_length(key, length, description):
+    """
+    Check a key the way PyNaCl does, so that invalid keys raise the same
+    exceptions whichever backend is used.
+    """
+    if not isinstance(key, six.binary_type):
+        raise nacl.exceptions.TypeError(
+            "The %s must be created from %s bytes." % (description, length)
+        )
+    if len(key) != length:
+        raise nacl.exceptions.ValueError(
+            "The %s must be exactly %s bytes long." % (description, length)
+        )
+
+
+_BACKENDS = (Backend, LibsodiumBackend, CryptographyBackend)
+
+
+def available_backends():
+    """
+    Return an instance of every backend that can be used on this system.
+
+    :rtype: list
+    """
+    backends = []
+    for backend_class in _BACKENDS:
+        try:
+            backends.append(backend_class())
+        except (ImportError, OSError, AttributeError):
+            continue
+    return backends
+
+
+def _measure(backend, reference):
+    """
+    Time the selection workload on a backend, or return `None` if the backend
+    disagrees with the reference backend.
+    """
+    seed = b"\x01" * _KEY_LENGTH
+    key = b"\x02" * _KEY_LENGTH
+    nonce = b"\x03" * _NONCE_LENGTH
+    message = b"\x04" * 64
+    public_key = nacl.bindings.crypto_sign_seed_keypair(seed)[0]
+
+    signing_key = backend.signing_key(seed)
+    verify_key = backend.verify_key(public_key)
+    secret_key = backend.secret_key(key)
+    signed = backend.sign(signing_key, message)
+    ciphertext = backend.encrypt(secret_key, message, nonce)
+    if (signed != reference.sign(reference.signing_key(seed), message) or
+            ciphertext != reference.encrypt(
+                reference.secret_key(key), message, nonce
+            ) or
+            backend.verify(verify_key, signed) != message or
+            backend.decrypt(secret_key, ciphertext) != message):
+        return None
+
+    def workload():
+        backend.verify(verify_key, backend.sign(signing_key, message))
+        backend.decrypt(
+            secret_key, backend.encrypt(secret_key, message, nonce)
+        )
+
+    return min(timeit.repeat(
+        workload, number=_SELECTION_NUMBER, repeat=_SELECTION_REPEAT
+    ))
+
+
+def select_backend(backends=None):
+    """
+    Time a short workload of signing, verification, encryption and decryption
+    on each backend, and return the fastest one. A backend is only chosen
+    over the ones before it if it is more than 10% faster. Backends that
+    don't work, or don't produce the same output as PyNaCl, are never chosen.
+
+    :param list backends: The backends to choose from, in order of
+        preference. If this is not provided, all available backends are
+        considered.
+    :rtype: Backend
+    """
+    if backends is None:
+        backends = available_backends()
+    reference = Backend()
+    best, best_time = reference, None
+    for backend in backends:
+        try:
+            elapsed = _measure(backend, reference)
+        except _BACKEND_ERRORS:
+            continue
+        if elapsed is None:
+            continue
+        if (best_time is None or
+                elapsed < best_time * (1 - _SELECTION_MARGIN)):
+            best, best_time = backend, elapsed
+    return best
+
+
+def get_backend():
+    """
+    Return the backend in use, selecting one if none has been chosen yet.
+
+    :rtype: Backend
+    """
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                _backend = select_backend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Choose the backend to use for keys prepared from now on. Objects that
+    have already prepared their keys keep using the previous backend.
+
+    :param backend: A :py:class:`Backend` instance, the name of an
+        available backend, or `None` to select one again on first use.
+    :raises ValueError: if there is no available backend with this name.
+    """
+    global _backend
+    if isinstance(backend, six.string_types):
+        for available in available_backends():
+            if available.name == backend:
+                backend = available
+                break
+        else:
+            raise ValueError("The backend %r is unavailable." % backend)
+    _backend = backend
@@ -0,0 +1,78 @@
+"""
+Small caching helpers used to keep expensive key objects around between calls.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=None):
+        """
+        Instantiate a new LRUCache.
+
+        LRUCache is a dictionary-like container that optionally evicts the
+        least recently used entry when it grows past a maximum size. It is
+        safe to use from multiple threads.
+
+        :param int maxsize: The maximum number of entries to keep. If this is
+            `None`, the cache is unbounded and nothing is ever evicted.
+        """
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("The maximum cache size must be at least 1.")
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the value for `key`, marking it as recently used.
+
+        :param key: The key to look up.
+        :param default: The value to return if the key is not in the cache.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def pop(self, key, default=None):
+        """
+        Remove `key` from the cache and return its value.
+
+        :param key: The key to remove.
+        :param default: The value to return if the key is not in the cache.
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def keys(self):
+        """
+        Return the cached keys, from least to most recently used.
+
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._data.keys())
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,257 @@
+"""
+Compression of message payloads.
+
+Ciphertext is incompressible, so payloads have to be compressed before they
+are encrypted. A topic that is given a :py:class:`Compressor` compresses the
+payloads it encodes, and marks each compressed message with the codec it
+used. Every topic decompresses the messages it decodes, whether it compresses
+its own or not.
+
+zlib is always available. lzma is part of the standard library but may be
+missing from some Python builds, and zstd requires the `zstandard` package.
+"""
+import zlib
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .exceptions import MalformedMessageError
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_ZSTD = 3
+
+# The codec byte of a message has this bit set if the payload was compressed
+# with a preset dictionary.
+_DICTIONARY = 0x80
+
+# Payloads shorter than this are sent uncompressed by default, as they rarely
+# shrink enough to make up for the time spent.
+DEFAULT_THRESHOLD = 128
+
+# The default maximum size of a decompressed payload, so that small malicious
+# messages can't make us allocate arbitrary amounts of memory.
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+
+# Payloads are compressed without headers or checksums, as messages are
+# already delimited and authenticated.
+_ZLIB_WBITS = -15
+if lzma is not None:
+    _LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "dict_size": 1 << 20}]
+
+
+def available_codecs():
+    """
+    Return the codecs that can be used on this system.
+
+    :rtype: list
+    """
+    return sorted(_DECOMPRESSORS)
+
+
+def _decompress_none(data, dictionary, max_size):
+    return data, True
+
+
+def _decompress_zlib(data, dictionary, max_size):
+    if dictionary is None:
+        decompressor = zlib.decompressobj(_ZLIB_WBITS)
+    else:
+        decompressor = zlib.decompressobj(_ZLIB_WBITS, zdict=dictionary)
+    try:
+        decompressed = decompressor.decompress(data, max_size + 1)
+    except zlib.error as e:
+        raise MalformedMessageError(str(e))
+    return decompressed, decompressor.eof
+
+
+def _decompress_lzma(data, dictionary, max_size):
+    decompressor = lzma.LZMADecompressor(
+        lzma.FORMAT_RAW, filters=_LZMA_FILTERS
+    )
+    try:
+        decompressed = decompressor.decompress(data, max_size + 1)
+    except lzma.LZMAError as e:
+        raise MalformedMessageError(str(e))
+    return decompressed, decompressor.eof
+
+
+def _decompress_zstd(data, dictionary, max_size):
+    if dictionary is None:
+        decompressor = zstandard.ZstdDecompressor()
+    else:
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(dictionary)
+        )
+    try:
+        decompressed = decompressor.decompress(
+            data, max_output_size=max_size + 1
+        )
+    except zstandard.ZstdError as e:
+        raise MalformedMessageError(str(e))
+    return decompressed, True
+
+
+# The decompression function of each available codec. Each takes the payload,
+# the dictionary and the maximum size, and returns the decompressed payload
+# (which may be longer than the maximum size) and whether it was complete.
+_DECOMPRESSORS = {
+    CODEC_NONE: _decompress_none,
+    CODEC_ZLIB: _decompress_zlib,
+}
+if lzma is not None:
+    _DECOMPRESSORS[CODEC_LZMA] = _decompress_lzma
+if zstandard is not None:
+    _DECOMPRESSORS[CODEC_ZSTD] = _decompress_zstd
+
+
+def decompress(codec, data, dictionary=None, max_size=DEFAULT_MAX_SIZE):
+    """
+    Decompress a payload.
+
+    :param int codec: The codec byte of the message.
+    :param bytes data: The compressed payload.
+    :param bytes dictionary: The preset dictionary, if the payload was
+        compressed with one.
+    :param int max_size: The maximum size of the decompressed payload.
+    :returns: The decompressed payload.
+    :rtype: bytes
+    :raises MalformedMessageError: if the codec is unknown or unavailable,
+        the payload is invalid or larger than `max_size`, or it needs a
+        dictionary we don't have.
+    """
+    if codec & _DICTIONARY:
+        if dictionary is None:
+            raise MalformedMessageError(
+                "The payload was compressed with an unknown dictionary."
+            )
+        codec &= ~_DICTIONARY
+    else:
+        dictionary = None
+
+    decompressor = _DECOMPRESSORS.get(codec)
+    if decompressor is None:
+        raise MalformedMessageError(
+            "The payload was compressed with an unavailable codec."
+        )
+    decompressed, complete = decompressor(data, dictionary, max_size)
+
+    if len(decompressed) > max_size:
+        raise MalformedMessageError(
+            "The decompressed payload is larger than the maximum of %s "
+            "bytes." % max_size
+        )
+    if not complete:
+        raise MalformedMessageError("The compressed payload is truncated.")
+    return decompressed
+
+
+class Compressor(object):
+    """
+    The compression settings of a topic.
+    """
+
+    def __init__(
+        self,
+        codec=CODEC_ZLIB,
+        threshold=DEFAULT_THRESHOLD,
+        level=None,
+        dictionary=None,
+        max_size=DEFAULT_MAX_SIZE
+    ):
+        """
+        :param int codec: The codec to compress payloads with, one of the
+            `CODEC_*` constants.
+        :param int threshold: Payloads shorter than this are not compressed.
+            Payloads that don't get smaller are never sent compressed.
+        :param int level: The compression level, or `None` for the codec's
+            default.
+        :param bytes dictionary: An optional preset dictionary, which makes
+            small, repetitive payloads (such as JSON telemetry) compress much
+            better. A good dictionary is a concatenation of typical payloads.
+            Every participant has to be given the same dictionary to be able
+            to decode the messages. Dictionaries are not supported by lzma.
+        :param int max_size: The maximum size of a decompressed payload.
+            Larger payloads are rejected.
+        :raises ValueError: if the codec is unavailable or doesn't support
+            dictionaries.
+        """
+        if codec not in available_codecs():
+            raise ValueError("The codec %s is unavailable." % codec)
+        if dictionary is not None and codec == CODEC_LZMA:
+            raise ValueError("lzma does not support preset dictionaries.")
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary
+        self.max_size = max_size
+
+        self._codec_byte = codec
+        if dictionary is not None and codec != CODEC_NONE:
+            self._codec_byte |= _DICTIONARY
+        if codec == CODEC_ZSTD:
+            options = {}
+            if level is not None:
+                options["level"] = level
+            if dictionary is not None:
+                options["dict_data"] = zstandard.ZstdCompressionDict(
+                    dictionary
+                )
+            self._zstd = zstandard.ZstdCompressor(**options)
+
+    def compress(self, data):
+        """
+        Compress a payload, if it's worth it.
+
+        :param bytes data: The payload.
+        :returns: A tuple of the codec byte and the compressed payload, or
+            `None` and the original payload if it wasn't compressed.
+        :rtype: tuple
+        """
+        if self.codec == CODEC_NONE or len(data) < self.threshold:
+            return None, data
+
+        codec = self.codec
+        level = self.level
+        if codec == CODEC_ZLIB:
+            if level is None:
+                level = zlib.Z_DEFAULT_COMPRESSION
+            if self.dictionary is None:
+                compressor = zlib.compressobj(level, zlib.DEFLATED, _ZLIB_WBITS)
+            else:
+                compressor = zlib.compressobj(
+                    level, zlib.DEFLATED, _ZLIB_WBITS, zdict=self.dictionary
+                )
+            compressed = compressor.compress(data) + compressor.flush()
+        elif codec == CODEC_LZMA:
+            filters = [dict(_LZMA_FILTERS[0])]
+            if level is not None:
+                filters[0]["preset"] = level
+            compressed = lzma.compress(
+                data, format=lzma.FORMAT_RAW, filters=filters
+            )
+        else:
+            compressed = self._zstd.compress(data)
+
+        if len(compressed) >= len(data):
+            return None, data
+        return self._codec_byte, compressed
+
+    def decompress(self, codec, data):
+        """
+        Decompress a payload with our dictionary and size limit. See
+        :py:func:`decompress`.
+
+        :param int codec: The codec byte of the message.
+        :param bytes data: The compressed payload.
+        :rtype: bytes
+        """
+        return decompress(codec, data, self.dictionary, self.max_size)
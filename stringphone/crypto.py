@@ -2,18 +2,41 @@
 Symmetric and asymmetric cryptography- and signing-related classes and methods.
 """
 import hashlib
+import hmac
+import itertools
+import os
+import struct
 
+import nacl.bindings
 import nacl.encoding
 import nacl.exceptions
+import nacl.hash
 import nacl.secret
 import nacl.signing
 import nacl.public
 import nacl.utils
-import six
 
+from .backends import get_backend
+from .cache import LRUCache
 from .exceptions import BadSignatureError
 
 PARTICIPANT_ID_LENGTH = 16
+MAC_LENGTH = 64
+NONCE_SIZE = nacl.secret.SecretBox.NONCE_SIZE
+
+_NONCE_COUNTER = struct.Struct(">Q")
+
+# Incremented in forked children, so that nonce sources can tell they have
+# been copied into a new process and must not continue where the parent is.
+_fork_generation = [0]
+
+
+def _after_fork():
+    _fork_generation[0] += 1
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
 
 
 def _get_id_from_key(public_key):
@@ -26,6 +49,42 @@ def _get_id_from_key(public_key):
     return hashlib.sha256(public_key).digest()[:PARTICIPANT_ID_LENGTH]
 
 
+if hasattr(hashlib, "blake2b"):
+    def _blake2b(data, digest_size, key, person=b""):
+        return hashlib.blake2b(
+            data, digest_size=digest_size, key=key, person=person
+        ).digest()
+else:  # pragma: no cover
+    # BLAKE2b was only added to hashlib in Python 3.6. libsodium's is much
+    # slower to call, but produces the same digests.
+    def _blake2b(data, digest_size, key, person=b""):
+        return nacl.hash.blake2b(
+            data, digest_size=digest_size, key=key, person=person,
+            encoder=nacl.encoding.RawEncoder,
+        )
+
+
+def _get_encryption_key(public_key):
+    """
+    Convert a participant's public signing key to the public encryption key
+    that corresponds to it, so we can encrypt to participants whose signing
+    key is all we know.
+    """
+    return nacl.bindings.crypto_sign_ed25519_pk_to_curve25519(
+        _as_bytes(public_key)
+    )
+
+
+def _as_bytes(data):
+    """
+    Return the given buffer as bytes. The bindings only accept bytes, so views
+    over other buffers have to be copied before they are handed over.
+    """
+    if isinstance(data, bytes):
+        return data
+    return memoryview(data).tobytes()
+
+
 def generate_topic_key():
     """
     Generate and return a new topic key. The generated key is cryptographically
@@ -48,9 +107,145 @@ def generate_signing_key_seed():
     return nacl.signing.SigningKey.generate().encode()
 
 
-class AsymmetricCrypto:
+class NonceSource(object):
+    """
+    The interface of nonce sources, which supply the nonces for symmetric
+    encryption. Nonces must never repeat for the same key, but don't have to
+    be unpredictable.
+
+    This one draws every nonce from the operating system's random source.
+    """
+
+    def nonce(self):
+        """
+        Return a new nonce.
+
+        :rtype: bytes
+        """
+        return nacl.utils.random(NONCE_SIZE)
+
+    def nonces(self, count):
+        """
+        Return a list of new nonces.
+
+        :param int count: The number of nonces.
+        :rtype: list
+        """
+        data = nacl.utils.random(NONCE_SIZE * count)
+        return [
+            data[offset:offset + NONCE_SIZE]
+            for offset in range(0, len(data), NONCE_SIZE)
+        ]
+
+
+class BufferedNonceSource(NonceSource):
+    """
+    A nonce source that draws random nonces from the operating system in
+    bulk, and hands them out from a buffer.
+    """
+
+    def __init__(self, batch_size=256):
+        """
+        :param int batch_size: The number of nonces to draw at a time.
+        """
+        self._batch_size = batch_size
+        self._nonces = iter(())
+        self._generation = _fork_generation[0]
+
+    def _refill(self):
+        # Threads that run out at the same time each draw a new batch, and
+        # only one of them is kept, which wastes nonces but never repeats
+        # one.
+        self._nonces = iter(NonceSource.nonces(self, self._batch_size))
+        self._generation = _fork_generation[0]
+
+    def nonce(self):
+        # A forked child must not hand out the nonces its parent will.
+        if self._generation == _fork_generation[0]:
+            nonce = next(self._nonces, None)
+            if nonce is not None:
+                return nonce
+        self._refill()
+        return next(self._nonces)
+
+    def nonces(self, count):
+        nonce = self.nonce
+        return [nonce() for _ in range(count)]
+
+
+class CounterNonceSource(NonceSource):
+    """
+    A nonce source that combines a random prefix with a counter.
+
+    The prefix is 16 random bytes drawn when the source is created (and again
+    in forked children), and the counter takes up the last 8 bytes. Nonces
+    from the same source never repeat, and nonces from different sources
+    (e.g. before and after a restart, or in other processes) only repeat if
+    their prefixes do, which is as unlikely as two random nonces colliding.
+    """
+
     def __init__(self):
-        self._private_key = nacl.public.PrivateKey.generate()
+        self._reseed()
+
+    def _reseed(self):
+        self._prefix = nacl.utils.random(NONCE_SIZE - _NONCE_COUNTER.size)
+        self._counter = itertools.count()
+        self._generation = _fork_generation[0]
+
+    def nonce(self):
+        if self._generation != _fork_generation[0]:
+            self._reseed()
+        # Advancing the counter is atomic, so this is thread-safe.
+        return self._prefix + _NONCE_COUNTER.pack(next(self._counter))
+
+    def nonces(self, count):
+        nonce = self.nonce
+        return [nonce() for _ in range(count)]
+
+
+class AsymmetricCrypto:
+    def __init__(self, box_cache_size=32, private_key=None):
+        """
+        Instantiate a new AsymmetricCrypto object with a new, ephemeral
+        encryption key.
+
+        Deriving the shared key for a peer is expensive, so the boxes for the
+        most recently used peer keys are kept around.
+
+        :param int box_cache_size: The maximum number of precomputed boxes to
+            keep. If this is `None`, the cache is unbounded.
+        :param bytes private_key: The optional private encryption key to use
+            instead of generating a new one, e.g. to resume a handshake after
+            a restart.
+        """
+        if private_key is None:
+            self._private_key = nacl.public.PrivateKey.generate()
+        else:
+            self._private_key = nacl.public.PrivateKey(private_key)
+        self._boxes = LRUCache(box_cache_size)
+
+    def _get_box(self, public_key):
+        """
+        Return the box for the given peer public key, precomputing the shared
+        key if it isn't already cached.
+
+        :param bytes public_key: The peer's public encryption key.
+        :rtype: nacl.public.Box
+        """
+        public_key = _as_bytes(public_key)
+        box = self._boxes.get(public_key)
+        if box is None:
+            box = nacl.public.Box(
+                self._private_key, nacl.public.PublicKey(public_key)
+            )
+            self._boxes[public_key] = box
+        return box
+
+    def clear_box_cache(self):
+        """
+        Forget all precomputed boxes.
+        """
+        self._boxes.clear()
 
     def encrypt(self, plaintext, public_key):
         """
@@ -62,9 +257,7 @@ class AsymmetricCrypto:
         :return: The ciphertext.
         :rtype: bytes
         """
-        box = nacl.public.Box(
-            self._private_key, nacl.public.PublicKey(public_key)
-        )
+        box = self._get_box(public_key)
         nonce = nacl.utils.random(nacl.public.Box.NONCE_SIZE)
         ciphertext = box.encrypt(plaintext, nonce)
         return ciphertext
@@ -79,10 +272,7 @@ class AsymmetricCrypto:
         :return: The plaintext.
         :rtype: bytes
         """
-        box = nacl.public.Box(
-            self._private_key, nacl.public.PublicKey(public_key)
-        )
-        return box.decrypt(ciphertext)
+        return self._get_box(public_key).decrypt(_as_bytes(ciphertext))
 
     @property
     def public_key(self):
@@ -93,9 +283,27 @@ class AsymmetricCrypto:
         """
         return self._private_key.public_key.encode()
 
+    @property
+    def private_key(self):
+        """
+        The private encryption key of the AsymmetricCrypto object.
+
+        :rtype: bytes
+        """
+        return self._private_key.encode()
+
+    def cached_keys(self):
+        """
+        Return the peer public keys that have precomputed boxes, from least to
+        most recently used.
+
+        :rtype: list
+        """
+        return self._boxes.keys()
+
 
 class SymmetricCrypto:
-    def __init__(self, key):
+    def __init__(self, key, nonce_source=None, backend=None):
         """
         Instantiate a new SymmetricCrypto object.
 
@@ -104,8 +312,30 @@ class SymmetricCrypto:
 
         :param bytes key: The key to use for encryption and decryption. Use
             `generate_topic_key` to generate this.
+        :param NonceSource nonce_source: The source of the nonces to encrypt
+            with. If this is not provided, every nonce is drawn from the
+            operating system's random source.
+        :param Backend backend: The backend to encrypt and decrypt with. If
+            this is not provided, the default one is used. See
+            :py:mod:`stringphone.backends`.
+        """
+        if nonce_source is None:
+            nonce_source = NonceSource()
+        if backend is None:
+            backend = get_backend()
+        self._key = key
+        self._secret_key = backend.secret_key(key)
+        self._backend = backend
+        self._nonce_source = nonce_source
+
+    @property
+    def key(self):
+        """
+        The key of this SymmetricCrypto object.
+
+        :rtype: bytes
         """
-        self._box = nacl.secret.SecretBox(key)
+        return self._key
 
     def encrypt(self, plaintext):
         """
@@ -116,8 +346,30 @@ class SymmetricCrypto:
         :return: The ciphertext.
         :rtype: bytes
         """
-        nonce = nacl.utils.random(nacl.secret.SecretBox.NONCE_SIZE)
-        return six.binary_type(self._box.encrypt(plaintext, nonce))
+        return self._backend.encrypt(
+            self._secret_key, plaintext, self._nonce_source.nonce()
+        )
+
+    def encrypt_many(self, plaintexts):
+        """
+        Encrypt a sequence of plaintexts.
+
+        This is equivalent to calling `encrypt` on each plaintext, but draws
+        the nonces for the whole batch from the nonce source at once.
+
+        :param plaintexts: An iterable of plaintexts to encrypt.
+
+        :return: The ciphertexts, in the same order as the plaintexts.
+        :rtype: list
+        """
+        plaintexts = list(plaintexts)
+        nonces = self._nonce_source.nonces(len(plaintexts))
+        encrypt = self._backend.encrypt
+        secret_key = self._secret_key
+        return [
+            encrypt(secret_key, plaintext, nonce)
+            for plaintext, nonce in zip(plaintexts, nonces)
+        ]
 
     def decrypt(self, ciphertext):
         """
@@ -128,18 +380,61 @@ class SymmetricCrypto:
         :return: The ciphertext.
         :rtype: bytes
         """
-        return self._box.decrypt(ciphertext)
+        return self._backend.decrypt(self._secret_key, _as_bytes(ciphertext))
+
+    def mac(self, sender_id, data):
+        """
+        Compute the message authentication code of data sent by a participant.
+
+        The code is a keyed BLAKE2b hash, with a key that is derived from the
+        symmetric key and the participant's ID. Anyone who knows the
+        symmetric key can compute it, so it proves that the data was sent by
+        someone who knows the key, not by which participant.
+
+        :param bytes sender_id: The ID of the participant that sent the data.
+        :param bytes data: The data to authenticate.
+
+        :return: The 64-byte code.
+        :rtype: bytes
+        """
+        key = _blake2b(
+            _as_bytes(sender_id), 32, self._key, person=b"stringphone-mac"
+        )
+        return _blake2b(_as_bytes(data), MAC_LENGTH, key)
+
+    def verify_mac(self, sender_id, data, mac):
+        """
+        Verify the message authentication code of data sent by a participant.
+
+        :param bytes sender_id: The ID of the participant that sent the data.
+        :param bytes data: The data.
+        :param bytes mac: The code to verify.
+        :raises BadSignatureError: The code was invalid.
+        """
+        if not hmac.compare_digest(
+                self.mac(sender_id, data), _as_bytes(mac)):
+            raise BadSignatureError(
+                "The message authentication code is invalid."
+            )
 
 
 class Signer:
-    def __init__(self, private_key):
+    def __init__(self, private_key, backend=None):
         """
         Instantiate a new Signer.
 
         :param bytes private_key: The private signing key to use. Use
             `generate_signing_key_seed` to generate this.
+        :param Backend backend: The backend to sign with. If this is not
+            provided, the default one is used. See
+            :py:mod:`stringphone.backends`.
         """
-        self._signer = nacl.signing.SigningKey(private_key)
+        if backend is None:
+            backend = get_backend()
+        self._seed = private_key
+        self._signing_key = backend.signing_key(private_key)
+        self._public_key = backend.public_key(self._signing_key)
+        self._backend = backend
 
     def sign(self, plaintext):
         """
@@ -150,8 +445,7 @@ class Signer:
         :return: The signed plaintext.
         :rtype: bytes
         """
-        signed = self._signer.sign(plaintext)
-        return six.binary_type(signed)
+        return self._backend.sign(self._signing_key, plaintext)
 
     @property
     def public_key(self):
@@ -160,17 +454,46 @@ class Signer:
 
         :rtype: bytes
         """
-        return self._signer.verify_key.encode()
+        return self._public_key
+
+    @property
+    def private_key(self):
+        """
+        The private signing key (seed) of this Signer object.
+
+        :rtype: bytes
+        """
+        return self._seed
+
+    @property
+    def encryption_private_key(self):
+        """
+        The private encryption key that corresponds to the signing key. Use
+        it with an `AsymmetricCrypto` to decrypt what others encrypted to our
+        public signing key.
+
+        :rtype: bytes
+        """
+        # The expanded secret key is the seed followed by the public key.
+        return nacl.bindings.crypto_sign_ed25519_sk_to_curve25519(
+            self._seed + self._public_key
+        )
 
 
 class Verifier:
-    def __init__(self, public_key):
+    def __init__(self, public_key, backend=None):
         """
         Instantiate a new Verifier.
 
         :param bytes public_key: The public signing key to use.
+        :param Backend backend: The backend to verify with. If this is not
+            provided, the default one is used. See
+            :py:mod:`stringphone.backends`.
         """
-        self._verifier = nacl.signing.VerifyKey(public_key)
+        if backend is None:
+            backend = get_backend()
+        self._verify_key = backend.verify_key(_as_bytes(public_key))
+        self._backend = backend
 
     def verify(self, signed):
         """
@@ -181,8 +504,4 @@ class Verifier:
         :rtype: bytes
         :raises BadSignatureError: The signature was invalid.
         """
-        try:
-            plaintext = self._verifier.verify(signed)
-        except nacl.exceptions.BadSignatureError as e:
-            raise BadSignatureError(str(e))
-        return plaintext
+        return self._backend.verify(self._verify_key, _as_bytes(signed))
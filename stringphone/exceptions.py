@@ -13,6 +13,11 @@ class IntroductionReplyError(Exception):
     pass
 
 
+class StreamChunkError(Exception):
+    "Raised when a message is a chunk of a stream."
+    pass
+
+
 class MalformedMessageError(Exception):
     "Raised when attempting to decode a malformed message."
     pass
@@ -0,0 +1,188 @@
+"""
+Transport framing for messages.
+
+Messages are delimited by size, so transports that don't preserve message
+boundaries (such as TCP sockets or serial lines) need some framing to split
+the byte stream back into messages. Each frame consists of a version byte,
+the length of the message as an unsigned LEB128 varint, and the message
+itself. For a typical small message, this adds two or three bytes.
+
+For transports that can only carry text, frames can additionally be encoded
+with base64 or base85.
+"""
+import base64
+
+from .exceptions import MalformedMessageError
+
+FRAMING_VERSION = 1
+
+# The default maximum length of a message in a frame, to avoid allocating
+# arbitrary amounts of memory when reading a corrupted or malicious stream.
+DEFAULT_MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+_TEXT_ENCODINGS = {
+    "base64": (base64.b64encode, base64.b64decode),
+    "base85": (base64.b85encode, base64.b85decode),
+}
+
+
+def _encode_varint(value):
+    """
+    Encode a non-negative integer as an unsigned LEB128 varint.
+    """
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _decode_header(data, offset, max_frame_size):
+    """
+    Decode the frame header starting at `offset`.
+
+    :returns: A tuple of (payload offset, payload length), or `None` if the
+        header is incomplete.
+    :raises MalformedMessageError: if the header is invalid.
+    """
+    if offset >= len(data):
+        return None
+    if data[offset] != FRAMING_VERSION:
+        raise MalformedMessageError(
+            "Unsupported framing version %s." % data[offset]
+        )
+
+    length = 0
+    shift = 0
+    position = offset + 1
+    while True:
+        if position >= len(data):
+            return None
+        byte = data[position]
+        position += 1
+        length |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+        if shift > 63:
+            raise MalformedMessageError("The frame length is too long.")
+
+    if length > max_frame_size:
+        raise MalformedMessageError(
+            "The frame is larger than the maximum of %s bytes." %
+            max_frame_size
+        )
+    return position, length
+
+
+def encode_frame(message, encoding=None):
+    """
+    Wrap a message in a frame.
+
+    :param bytes message: The message to frame.
+    :param str encoding: The optional text encoding to apply to the frame,
+        either "base64" or "base85".
+    :returns: The framed message.
+    :rtype: bytes
+    """
+    frame = b"".join((
+        bytes(bytearray((FRAMING_VERSION,))),
+        _encode_varint(len(message)),
+        message,
+    ))
+    if encoding is not None:
+        frame = _TEXT_ENCODINGS[encoding][0](frame)
+    return frame
+
+
+def decode_frame(frame, encoding=None, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+    """
+    Unwrap the message in a single, complete frame.
+
+    :param bytes frame: The frame to unwrap.
+    :param str encoding: The optional text encoding of the frame, either
+        "base64" or "base85".
+    :param int max_frame_size: The maximum length of the message.
+    :returns: The message, as a view of the frame.
+    :rtype: memoryview
+    :raises MalformedMessageError: if the frame is invalid, incomplete or has
+        trailing data.
+    """
+    if encoding is not None:
+        frame = _TEXT_ENCODINGS[encoding][1](frame)
+    view = memoryview(frame)
+    header = _decode_header(view, 0, max_frame_size)
+    if header is None or header[0] + header[1] != len(view):
+        raise MalformedMessageError("The frame length is incorrect.")
+    return view[header[0]:]
+
+
+class Deframer(object):
+    """
+    Split a byte stream into messages.
+
+    Feed the deframer data as it arrives from the transport, in chunks of any
+    size, and it will return the messages as soon as they are complete.
+    """
+
+    def __init__(self, max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        """
+        :param int max_frame_size: The maximum length of a message. Frames
+            that claim to be longer are rejected.
+        """
+        self._buffer = bytearray()
+        self._max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """
+        Add data from the stream and return any messages it completes.
+
+        The returned messages are views over a single copy of the completed
+        part of the buffer, so messages are not copied individually. Wrap them
+        in a `MessageView <stringphone.topic.MessageView>` to decode them
+        without copying them again.
+
+        :param bytes data: The data received from the transport.
+        :returns: A list of complete messages.
+        :rtype: list
+        :raises MalformedMessageError: if the stream is corrupted. The stream
+            can't be recovered after this.
+        """
+        self._buffer += data
+
+        offset = 0
+        spans = []
+        while True:
+            header = _decode_header(self._buffer, offset, self._max_frame_size)
+            if header is None:
+                break
+            start, length = header
+            if start + length > len(self._buffer):
+                break
+            spans.append((start, start + length))
+            offset = start + length
+
+        if not spans:
+            return []
+
+        # Copy the completed part out through a view, which copies it once
+        # rather than twice, and release the view before resizing the
+        # buffer.
+        with memoryview(self._buffer) as view:
+            completed = memoryview(view[:offset].tobytes())
+        del self._buffer[:offset]
+        return [completed[start:end] for start, end in spans]
+
+    @property
+    def pending(self):
+        """
+        The number of buffered bytes that are not part of a complete frame
+        yet.
+
+        :rtype: int
+        """
+        return len(self._buffer)
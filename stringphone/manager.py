@@ -0,0 +1,219 @@
+"""
+Participating in many topics with one identity.
+
+Transports usually already know which topic a message arrived on (the MQTT
+topic, the chat room, the socket), so the manager routes messages by a topic
+name that the application chooses, rather than by anything in the message.
+"""
+from .topic import Topic
+
+
+class TopicManager(object):
+    """
+    A collection of topics that share one identity.
+
+    Topics created by the manager share our signing key, ID, ephemeral
+    encryption key, sequence numbers, nonce source, metrics and the verifier
+    and box caches, and by default also the roster of trusted participants.
+    Each topic only keeps its own topic key, and its replay and duplicate
+    state if enabled, so thousands of topics take little more memory than
+    one.
+
+    Topics see the shared roster through an :py:class:`OverlayParticipantStore
+    <stringphone.store.OverlayParticipantStore>`, so participants added to or
+    removed from one topic are only trusted or distrusted on that topic. Use
+    the manager's :py:meth:`add_participant` and :py:meth:`remove_participant`
+    to change the shared roster, which affects every topic that hasn't
+    overridden the participant.
+    """
+
+    def __init__(
+        self,
+        signing_key_seed=None,
+        participants=None,
+        verifier_cache_size=None,
+        metrics=None,
+        event_callback=None,
+        nonce_source=None
+    ):
+        """
+        The arguments are the same as those of :py:class:`Topic
+        <stringphone.topic.Topic>`, and apply to all the managed topics.
+
+        :param bytes signing_key_seed: The optional seed for our signing key.
+        :param dict participants: The optional roster of trusted participants
+            that topics share by default.
+        :param int verifier_cache_size: The optional maximum number of
+            participant verifiers to keep around, across all topics.
+        :param MetricsSink metrics: The optional sink to report the metrics
+            of all topics to.
+        :param event_callback: The optional function to notify of messages
+            that are silently dropped while decoding.
+        :param NonceSource nonce_source: The optional source of the nonces to
+            encrypt the messages of all topics with.
+        """
+        self._identity = Topic(
+            signing_key_seed=signing_key_seed,
+            participants=participants,
+            verifier_cache_size=verifier_cache_size,
+            metrics=metrics,
+            event_callback=event_callback,
+            nonce_source=nonce_source,
+        )
+        self._topics = {}
+
+    @property
+    def id(self):
+        """
+        Our ID.
+
+        :rtype: bytes
+        """
+        return self._identity.id
+
+    @property
+    def public_key(self):
+        """
+        Our public key.
+
+        :rtype: bytes
+        """
+        return self._identity.public_key
+
+    def participants(self):
+        """
+        Return the shared roster of trusted participants.
+
+        :rtype: dict
+        """
+        return self._identity.participants()
+
+    def add_participant(self, public_key):
+        """
+        Add a participant to the shared roster.
+
+        :param bytes public_key: The public key of the participant to add.
+        """
+        self._identity.add_participant(public_key)
+
+    def remove_participant(self, participant_id):
+        """
+        Remove a participant from the shared roster.
+
+        :param bytes participant_id: The ID of the participant to remove.
+        """
+        self._identity.remove_participant(participant_id)
+
+    def add_topic(
+        self,
+        name,
+        topic_key=None,
+        participants=None,
+        replay_window=None,
+        replay_senders=4096,
+        duplicate_cache_size=None,
+        key_history=4,
+        mac_authentication=False,
+        compression=None
+    ):
+        """
+        Create a topic and start routing messages to it.
+
+        :param name: The name to route messages by, such as the name of the
+            channel the topic is on. This can be any hashable value.
+        :param bytes topic_key: The optional symmetric encryption key of the
+            topic.
+        :param dict participants: The optional roster of trusted participants
+            of this topic. If this is not provided, the topic uses the shared
+            roster.
+        :param int replay_window: See :py:class:`Topic
+            <stringphone.topic.Topic>`.
+        :param int replay_senders: See :py:class:`Topic
+            <stringphone.topic.Topic>`.
+        :param int duplicate_cache_size: See :py:class:`Topic
+            <stringphone.topic.Topic>`.
+        :param int key_history: See :py:class:`Topic
+            <stringphone.topic.Topic>`.
+        :param bool mac_authentication: See :py:class:`Topic
+            <stringphone.topic.Topic>`.
+        :param Compressor compression: See :py:class:`Topic
+            <stringphone.topic.Topic>`.
+        :returns: The new topic.
+        :rtype: Topic
+        :raises ValueError: if there is already a topic with this name.
+        """
+        if name in self._topics:
+            raise ValueError("There is already a topic named %r." % (name,))
+        topic = self._identity._derive(
+            topic_key=topic_key,
+            participants=participants,
+            replay_window=replay_window,
+            replay_senders=replay_senders,
+            duplicate_cache_size=duplicate_cache_size,
+            key_history=key_history,
+            mac_authentication=mac_authentication,
+            compression=compression,
+        )
+        self._topics[name] = topic
+        return topic
+
+    def remove_topic(self, name):
+        """
+        Stop routing messages to a topic, and discard it.
+
+        :param name: The name of the topic.
+        :raises KeyError: if there is no topic with this name.
+        """
+        del self._topics[name]
+
+    def __getitem__(self, name):
+        return self._topics[name]
+
+    def __contains__(self, name):
+        return name in self._topics
+
+    def __iter__(self):
+        return iter(self._topics)
+
+    def __len__(self):
+        return len(self._topics)
+
+    def encode(self, name, message):
+        """
+        Encode a message for a topic. See :py:meth:`Topic.encode
+        <stringphone.topic.Topic.encode>`.
+
+        :param name: The name of the topic.
+        :param bytes message: The plaintext to encode.
+        :rtype: bytes
+        :raises KeyError: if there is no topic with this name.
+        """
+        return self._topics[name].encode(message)
+
+    def decode(self, name, message, naive=False, ignore_untrusted=False):
+        """
+        Decode a message received on a topic. See :py:meth:`Topic.decode
+        <stringphone.topic.Topic.decode>`.
+
+        :param name: The name of the topic the message arrived on.
+        :param bytes message: The raw message.
+        :rtype: bytes
+        :raises KeyError: if there is no topic with this name.
+        """
+        return self._topics[name].decode(
+            message, naive=naive, ignore_untrusted=ignore_untrusted
+        )
+
+    def decode_many(self, name, messages, naive=False, ignore_untrusted=False):
+        """
+        Decode a batch of messages received on a topic. See
+        :py:meth:`Topic.decode_many <stringphone.topic.Topic.decode_many>`.
+
+        :param name: The name of the topic the messages arrived on.
+        :param messages: The raw messages.
+        :rtype: list
+        :raises KeyError: if there is no topic with this name.
+        """
+        return self._topics[name].decode_many(
+            messages, naive=naive, ignore_untrusted=ignore_untrusted
+        )
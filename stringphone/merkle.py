@@ -0,0 +1,95 @@
+"""
+Merkle trees for signing batches of messages with a single signature.
+
+The tree is built as in RFC 6962 (Certificate Transparency): leaves and inner
+nodes are hashed with SHA-256 under different prefixes, so that a leaf can't
+be passed off as an inner node, and a tree whose size is not a power of two
+is split at the largest power of two smaller than its size. The inclusion
+proof of a leaf is the list of sibling hashes from the leaf up to the root.
+"""
+import hashlib
+
+HASH_LENGTH = 32
+
+_LEAF_PREFIX = b"\x00"
+_NODE_PREFIX = b"\x01"
+
+
+def leaf_hash(*parts):
+    """
+    Hash the data of a leaf.
+
+    :param parts: The buffers whose concatenation is the data of the leaf.
+    :rtype: bytes
+    """
+    hasher = hashlib.sha256(_LEAF_PREFIX)
+    for part in parts:
+        hasher.update(part)
+    return hasher.digest()
+
+
+def node_hash(left, right):
+    """
+    Hash two child nodes into their parent.
+
+    :param bytes left: The hash of the left child.
+    :param bytes right: The hash of the right child.
+    :rtype: bytes
+    """
+    return hashlib.sha256(_NODE_PREFIX + left + right).digest()
+
+
+def build_tree(leaves):
+    """
+    Build a tree over the given leaf hashes.
+
+    :param list leaves: The leaf hashes, at least one.
+    :returns: A tuple of the root hash and the inclusion proof of every leaf,
+        in order.
+    :rtype: tuple
+    """
+    if len(leaves) == 1:
+        return leaves[0], [[]]
+    split = 1 << ((len(leaves) - 1).bit_length() - 1)
+    left_root, left_proofs = build_tree(leaves[:split])
+    right_root, right_proofs = build_tree(leaves[split:])
+    for proof in left_proofs:
+        proof.append(right_root)
+    for proof in right_proofs:
+        proof.append(left_root)
+    return node_hash(left_root, right_root), left_proofs + right_proofs
+
+
+def root_from_proof(leaf, index, size, proof):
+    """
+    Compute the root of a tree from a leaf and its inclusion proof.
+
+    :param bytes leaf: The hash of the leaf.
+    :param int index: The position of the leaf in the tree.
+    :param int size: The number of leaves in the tree.
+    :param proof: The inclusion proof of the leaf, as a sequence of hashes.
+    :returns: The root hash, or `None` if the proof doesn't fit the position
+        and size of the tree.
+    :rtype: bytes
+    """
+    if index >= size:
+        return None
+    position = index
+    last = size - 1
+    node = leaf
+    for sibling in proof:
+        if last == 0:
+            return None
+        if position & 1 or position == last:
+            node = node_hash(sibling, node)
+            # Skip the levels where this node had no sibling.
+            while not position & 1 and position:
+                position >>= 1
+                last >>= 1
+        else:
+            node = node_hash(node, sibling)
+        position >>= 1
+        last >>= 1
+    if last != 0:
+        return None
+    return node
@@ -0,0 +1,162 @@
+"""
+Instrumentation of topics.
+
+A topic that is given a metrics sink reports counters (such as the number of
+messages decoded or dropped) and timings (such as how long verification and
+decryption take) to it. Counter names end in `_total` and timing names in
+`_seconds`.
+"""
+import bisect
+import threading
+import timeit
+
+# The clock used to time operations.
+clock = timeit.default_timer
+
+# The default upper bounds of the timing histogram buckets, in seconds.
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+
+
+class MetricsSink(object):
+    """
+    The interface that metrics sinks implement. This one discards everything,
+    so subclasses only need to override what they are interested in.
+    """
+
+    def increment(self, name, value=1):
+        """
+        Increment a counter.
+
+        :param str name: The name of the counter.
+        :param int value: The amount to increment it by.
+        """
+
+    def observe(self, name, seconds):
+        """
+        Record a timing.
+
+        :param str name: The name of the timing.
+        :param float seconds: The duration of the operation.
+        """
+
+
+class CallbackSink(MetricsSink):
+    """
+    A sink that calls a function for every metric.
+
+    The function is called with the kind of the metric ("counter" or
+    "timing"), its name, and the value.
+    """
+
+    def __init__(self, callback):
+        """
+        :param callback: The function to call.
+        """
+        self._callback = callback
+
+    def increment(self, name, value=1):
+        self._callback("counter", name, value)
+
+    def observe(self, name, seconds):
+        self._callback("timing", name, seconds)
+
+
+class _Histogram(object):
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry(MetricsSink):
+    """
+    A sink that aggregates metrics in memory, keeping a total for every
+    counter and a histogram for every timing.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: The sorted upper bounds of the histogram buckets, in
+            seconds.
+        """
+        self._buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = _Histogram(self._buckets)
+            histogram.counts[bisect.bisect_left(self._buckets, seconds)] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def counter(self, name):
+        """
+        Return the current value of a counter.
+
+        :param str name: The name of the counter.
+        :rtype: int
+        """
+        return self._counters.get(name, 0)
+
+    def timing(self, name):
+        """
+        Return the number and total duration of the observations of a timing.
+
+        :param str name: The name of the timing.
+        :returns: A tuple of (count, total seconds).
+        :rtype: tuple
+        """
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            return 0, 0.0
+        return histogram.count, histogram.sum
+
+    def reset(self):
+        """
+        Discard all recorded metrics.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self, prefix="stringphone"):
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        :param str prefix: The prefix to add to every metric name.
+        :rtype: str
+        """
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                full_name = "%s_%s" % (prefix, name)
+                lines.append("# TYPE %s counter" % full_name)
+                lines.append("%s %s" % (full_name, self._counters[name]))
+
+            for name in sorted(self._histograms):
+                histogram = self._histograms[name]
+                full_name = "%s_%s" % (prefix, name)
+                lines.append("# TYPE %s histogram" % full_name)
+                cumulative = 0
+                bounds = [repr(b) for b in self._buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        '%s_bucket{le="%s"} %s' % (full_name, bound, cumulative)
+                    )
+                lines.append("%s_sum %r" % (full_name, histogram.sum))
+                lines.append("%s_count %s" % (full_name, histogram.count))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,127 @@
+"""
+Parallel decoding of messages across multiple threads.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import MalformedMessageError
+from .topic import MESSAGE_ROTATION, _as_message
+
+
+def _sender_id(message):
+    """
+    Return the ID of the sender of a parsed message, or `None` if it doesn't
+    have one.
+    """
+    try:
+        return message.sender_id
+    except ValueError:
+        return None
+
+
+class DecodePool(object):
+    """
+    A pool of threads that decodes messages for a `Topic
+    <stringphone.topic.Topic>`.
+
+    The underlying libsodium calls release the GIL, so signature verification
+    and decryption scale with the number of threads. Messages are sharded by
+    sender, and each shard is decoded in order by a single thread, so messages
+    from the same sender are always processed in the order they were
+    received. Key rotations affect the messages of every sender, so they act
+    as barriers: the messages before a rotation are decoded before it, and
+    the ones after it are decoded after it.
+
+    Threads are used rather than processes, as topics hold key material that
+    can't (and shouldn't) be pickled across process boundaries.
+    """
+
+    def __init__(self, topic, workers=4, executor=None):
+        """
+        :param Topic topic: The topic to decode messages for.
+        :param int workers: The number of threads, and thus shards, to use.
+        :param concurrent.futures.Executor executor: The optional executor to
+            use. If this is not provided, a thread pool of `workers` threads
+            is created, and shut down by `close`.
+        """
+        if workers < 1:
+            raise ValueError("The number of workers must be at least 1.")
+        self.topic = topic
+        self._workers = workers
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        self._executor = executor
+
+    def decode_many(self, messages, naive=False, ignore_untrusted=False):
+        """
+        Decode a batch of messages in parallel.
+
+        This returns exactly what `Topic.decode_many
+        <stringphone.topic.Topic.decode_many>` would.
+
+        :param messages: An iterable of raw messages from the channel.
+        :param bool naive: If `True`, signature verification **IS NOT
+            PERFORMED**. Use at your own risk.
+        :param bool ignore_untrusted: If `True`, messages from unknown
+            participants will be silently ignored.
+        :returns: A list with one entry per message, in order.
+        :rtype: list
+        """
+        results = []
+        batch = []
+        for position, message in enumerate(messages):
+            try:
+                message = _as_message(message)
+                message_type = message.type
+            except MalformedMessageError as e:
+                results.append(e)
+                continue
+            results.append(None)
+            if message_type == MESSAGE_ROTATION:
+                # A rotation changes the key that the messages after it are
+                # decoded with, so everything before it is decoded first,
+                # and then the rotation itself.
+                self._decode_shards(batch, results, naive, ignore_untrusted)
+                batch = []
+                results[position] = self.topic.decode_many(
+                    [message], naive, ignore_untrusted
+                )[0]
+            else:
+                batch.append((position, message))
+        self._decode_shards(batch, results, naive, ignore_untrusted)
+        return results
+
+    def _decode_shards(self, batch, results, naive, ignore_untrusted):
+        """
+        Decode (position, message) pairs in parallel, sharded by sender, and
+        store the results at their positions.
+        """
+        shards = [([], []) for _ in range(self._workers)]
+        for position, message in batch:
+            sender_id = _sender_id(message)
+            shard = shards[hash(sender_id) % self._workers if sender_id else 0]
+            shard[0].append(position)
+            shard[1].append(message)
+
+        futures = [
+            (positions, self._executor.submit(
+                self.topic.decode_many, shard, naive, ignore_untrusted
+            ))
+            for positions, shard in shards if shard
+        ]
+        for positions, future in futures:
+            for position, result in zip(positions, future.result()):
+                results[position] = result
+
+    def close(self):
+        """
+        Shut down the thread pool, if the pool created it.
+        """
+        if self._own_executor:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
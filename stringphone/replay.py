@@ -0,0 +1,149 @@
+"""
+Replay protection for sequenced messages.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+
+# The largest supported window, as each sender's window is a 64-bit bitmap.
+MAX_WINDOW = 64
+
+
+class ReplayWindow(object):
+    """
+    A sliding window of the sequence numbers seen from each sender.
+
+    For every sender, this keeps the highest sequence number seen and a bitmap
+    of which of the `window` sequence numbers below it have also been seen.
+    Messages older than the window are rejected, so messages that arrive out
+    of order are accepted only if they are less than `window` messages late.
+
+    The state for all senders lives in two preallocated arrays, so memory use
+    is fixed at 16 bytes per sender (plus the index) regardless of traffic.
+    When more than `max_senders` senders are active, the state of the least
+    recently seen sender is discarded, after which replays of that sender's
+    old messages can no longer be detected.
+    """
+
+    def __init__(self, window=MAX_WINDOW, max_senders=4096):
+        """
+        :param int window: The number of sequence numbers below the highest
+            one that are remembered, at most 64.
+        :param int max_senders: The maximum number of senders to keep state
+            for.
+        """
+        if not 0 < window <= MAX_WINDOW:
+            raise ValueError(
+                "The window must be between 1 and %s." % MAX_WINDOW
+            )
+        if max_senders < 1:
+            raise ValueError("The number of senders must be at least 1.")
+        self.window = window
+        self.max_senders = max_senders
+        self._highest = array("Q", [0]) * max_senders
+        self._seen = array("Q", [0]) * max_senders
+        self._slots = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, sender_id, sequence):
+        """
+        Check whether a message is new, without recording it.
+
+        :param bytes sender_id: The ID of the sender.
+        :param int sequence: The sequence number of the message.
+        :returns: `False` if the message has been seen before or is too old
+            to tell, `True` otherwise.
+        :rtype: bool
+        """
+        slot = self._slots.get(sender_id)
+        if slot is None:
+            return True
+        highest = self._highest[slot]
+        if sequence > highest:
+            return True
+        age = highest - sequence
+        if age >= self.window:
+            return False
+        return not (self._seen[slot] >> age) & 1
+
+    def update(self, sender_id, sequence):
+        """
+        Record a message as seen. Only do this after the message has been
+        authenticated, otherwise forged sequence numbers could advance the
+        window.
+
+        :param bytes sender_id: The ID of the sender.
+        :param int sequence: The sequence number of the message.
+        """
+        with self._lock:
+            slot = self._slots.pop(sender_id, None)
+            if slot is None:
+                if len(self._slots) < self.max_senders:
+                    slot = len(self._slots)
+                else:
+                    _, slot = self._slots.popitem(last=False)
+                self._highest[slot] = sequence
+                self._seen[slot] = 1
+            else:
+                highest = self._highest[slot]
+                if sequence > highest:
+                    shift = sequence - highest
+                    if shift < MAX_WINDOW:
+                        seen = (self._seen[slot] << shift) & 0xffffffffffffffff
+                    else:
+                        seen = 0
+                    self._highest[slot] = sequence
+                    self._seen[slot] = seen | 1
+                elif highest - sequence < self.window:
+                    self._seen[slot] |= 1 << (highest - sequence)
+            self._slots[sender_id] = slot
+
+    def export(self):
+        """
+        Return the state of every tracked sender, from least to most recently
+        seen.
+
+        :returns: A list of (sender ID, highest sequence number, bitmap)
+            tuples.
+        :rtype: list
+        """
+        with self._lock:
+            return [
+                (sender_id, self._highest[slot], self._seen[slot])
+                for sender_id, slot in self._slots.items()
+            ]
+
+    def load(self, state):
+        """
+        Restore the state returned by `export`, replacing the current one.
+
+        :param list state: The exported state.
+        """
+        with self._lock:
+            self._slots.clear()
+            for sender_id, highest, seen in state[-self.max_senders:]:
+                slot = len(self._slots)
+                self._highest[slot] = highest
+                self._seen[slot] = seen
+                self._slots[sender_id] = slot
+
+    def forget(self, sender_id):
+        """
+        Discard the state of a sender.
+
+        :param bytes sender_id: The ID of the sender.
+        """
+        with self._lock:
+            slot = self._slots.pop(sender_id, None)
+            if slot is None:
+                return
+            # Move the last slot into the freed one, so that the used slots
+            # stay contiguous.
+            last = len(self._slots)
+            if slot != last:
+                for other, other_slot in self._slots.items():
+                    if other_slot == last:
+                        self._slots[other] = slot
+                        break
+                self._highest[slot] = self._highest[last]
+                self._seen[slot] = self._seen[last]
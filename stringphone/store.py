@@ -0,0 +1,349 @@
+"""
+Participant stores.
+
+A topic keeps its trusted participants in a participant store, which is any
+mutable mapping of participant IDs to public keys. The default is a plain
+`dict`, which is fine for small rosters. For very large rosters, the
+:py:class:`MappedParticipantStore` keeps the participants on disk.
+"""
+import mmap
+import os
+import struct
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # pragma: no cover
+    from collections import MutableMapping
+
+from .crypto import PARTICIPANT_ID_LENGTH
+
+PUBLIC_KEY_LENGTH = 32
+
+_MAGIC = b"SPPS"
+_VERSION = 1
+_HEADER = struct.Struct(">4sB3x")
+_RECORD_LENGTH = PARTICIPANT_ID_LENGTH + PUBLIC_KEY_LENGTH
+
+_LOG_ADD = b"+"
+_LOG_REMOVE = b"-"
+_LOG_RECORD_LENGTH = 1 + _RECORD_LENGTH
+
+# os.rename can't replace an existing file on Windows, and os.replace, which
+# can, doesn't exist on Python 2.
+_replace = getattr(os, "replace", os.rename)
+
+
+def _fsync_directory(path):
+    """
+    Flush the directory entries of the directory that contains a file, so
+    that a file created or renamed in it survives a crash.
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:  # pragma: no cover
+        # Directories can't be opened on Windows, which doesn't need this.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ParticipantStore(MutableMapping):
+    """
+    The base class of participant stores. A store maps participant IDs
+    (bytes) to their public signing keys (bytes).
+
+    Subclasses must implement the abstract methods of
+    :py:class:`collections.abc.MutableMapping`. Membership checks and lookups
+    are on the decoding hot path, so they should be fast.
+    """
+
+
+class OverlayParticipantStore(ParticipantStore):
+    """
+    A participant store that records changes over a shared roster, without
+    changing the roster itself.
+
+    Participants added to or removed from the overlay only affect the
+    overlay, while changes to the shared roster are visible through it,
+    unless the overlay overrides them.
+    """
+
+    def __init__(self, base):
+        """
+        :param base: The shared roster, any mapping of participant IDs to
+            public keys.
+        """
+        self.base = base
+        self._added = {}
+        self._removed = set()
+
+    def __getitem__(self, participant_id):
+        public_key = self._added.get(participant_id)
+        if public_key is not None:
+            return public_key
+        if participant_id in self._removed:
+            raise KeyError(participant_id)
+        return self.base[participant_id]
+
+    def __contains__(self, participant_id):
+        if participant_id in self._added:
+            return True
+        if participant_id in self._removed:
+            return False
+        return participant_id in self.base
+
+    def __setitem__(self, participant_id, public_key):
+        self._added[participant_id] = public_key
+        self._removed.discard(participant_id)
+
+    def __delitem__(self, participant_id):
+        if participant_id not in self:
+            raise KeyError(participant_id)
+        self._added.pop(participant_id, None)
+        self._removed.add(participant_id)
+
+    def items(self):
+        """
+        Iterate over all (participant ID, public key) pairs.
+        """
+        for participant_id, public_key in self.base.items():
+            if (participant_id not in self._removed and
+                    participant_id not in self._added):
+                yield participant_id, public_key
+        for item in self._added.items():
+            yield item
+
+    def __iter__(self):
+        for participant_id, _ in self.items():
+            yield participant_id
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+
+class MappedParticipantStore(ParticipantStore):
+    """
+    A participant store that persists participants to disk.
+
+    The participants are kept in two files. The main file contains a header
+    and fixed-width records of participant ID and public key, sorted by ID.
+    It is memory-mapped and binary-searched, so opening the store takes
+    constant time and memory regardless of the size of the roster. Changes
+    are appended to a log file next to it (with a ".log" suffix), which is
+    replayed into memory when the store is opened. Call `compact` every so
+    often to merge the log into the main file.
+    """
+
+    def __init__(self, path):
+        """
+        Open (or create) a store.
+
+        :param str path: The path to the main file of the store.
+        :raises ValueError: if the store is corrupted.
+        """
+        self.path = path
+        self.log_path = path + ".log"
+        self._added = {}
+        self._removed = set()
+        self._file = None
+        self._map = None
+        self._count = 0
+
+        self._open_main()
+        try:
+            self._replay_log()
+        except ValueError:
+            self._close_main()
+            raise
+        self._log = open(self.log_path, "ab")
+
+    def _open_main(self):
+        if not os.path.exists(self.path):
+            with open(self.path, "wb") as outfile:
+                outfile.write(_HEADER.pack(_MAGIC, _VERSION))
+
+        self._file = open(self.path, "rb")
+        header = self._file.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise ValueError("The participant store is corrupted.")
+        magic, version = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("The participant store has an unknown format.")
+
+        size = os.fstat(self._file.fileno()).st_size
+        if (size - _HEADER.size) % _RECORD_LENGTH:
+            raise ValueError("The participant store is corrupted.")
+        self._count = (size - _HEADER.size) // _RECORD_LENGTH
+        if self._count:
+            self._map = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r+b") as infile:
+            end = 0
+            while True:
+                record = infile.read(_LOG_RECORD_LENGTH)
+                if len(record) < _LOG_RECORD_LENGTH:
+                    break
+                operation = record[0:1]
+                participant_id = record[1:1 + PARTICIPANT_ID_LENGTH]
+                if operation == _LOG_ADD:
+                    self._added[participant_id] = record[
+                        1 + PARTICIPANT_ID_LENGTH:
+                    ]
+                    self._removed.discard(participant_id)
+                elif operation == _LOG_REMOVE:
+                    self._added.pop(participant_id, None)
+                    self._removed.add(participant_id)
+                else:
+                    raise ValueError("The participant store log is corrupted.")
+                end += _LOG_RECORD_LENGTH
+            if record:
+                # Discard a partially written last record, so that new
+                # records are appended after the last complete one.
+                infile.truncate(end)
+
+    def _find(self, participant_id):
+        """
+        Binary search the main file for a participant.
+
+        :returns: The participant's public key, or `None`.
+        """
+        low, high = 0, self._count
+        mapped = self._map
+        while low < high:
+            middle = (low + high) // 2
+            offset = _HEADER.size + middle * _RECORD_LENGTH
+            current = mapped[offset:offset + PARTICIPANT_ID_LENGTH]
+            if current < participant_id:
+                low = middle + 1
+            elif current > participant_id:
+                high = middle
+            else:
+                offset += PARTICIPANT_ID_LENGTH
+                return mapped[offset:offset + PUBLIC_KEY_LENGTH]
+        return None
+
+    def _iter_main(self):
+        for index in range(self._count):
+            offset = _HEADER.size + index * _RECORD_LENGTH
+            yield (
+                self._map[offset:offset + PARTICIPANT_ID_LENGTH],
+                self._map[offset + PARTICIPANT_ID_LENGTH:
+                          offset + _RECORD_LENGTH],
+            )
+
+    def _write_log(self, operation, participant_id, public_key):
+        self._log.write(operation + participant_id + public_key)
+        self._log.flush()
+
+    def __getitem__(self, participant_id):
+        public_key = self._added.get(participant_id)
+        if public_key is not None:
+            return public_key
+        if participant_id not in self._removed:
+            public_key = self._find(participant_id)
+            if public_key is not None:
+                return public_key
+        raise KeyError(participant_id)
+
+    def __contains__(self, participant_id):
+        if participant_id in self._added:
+            return True
+        if participant_id in self._removed:
+            return False
+        return self._find(participant_id) is not None
+
+    def __setitem__(self, participant_id, public_key):
+        if (len(participant_id) != PARTICIPANT_ID_LENGTH or
+                len(public_key) != PUBLIC_KEY_LENGTH):
+            raise ValueError("Invalid participant ID or public key length.")
+        participant_id = bytes(participant_id)
+        public_key = bytes(public_key)
+        self._write_log(_LOG_ADD, participant_id, public_key)
+        self._added[participant_id] = public_key
+        self._removed.discard(participant_id)
+
+    def __delitem__(self, participant_id):
+        if participant_id not in self:
+            raise KeyError(participant_id)
+        self._write_log(
+            _LOG_REMOVE, participant_id, b"\0" * PUBLIC_KEY_LENGTH
+        )
+        self._added.pop(participant_id, None)
+        self._removed.add(participant_id)
+
+    def items(self):
+        """
+        Iterate over all (participant ID, public key) pairs, in ID order for
+        the participants in the main file, followed by the ones in the log.
+        """
+        for participant_id, public_key in self._iter_main():
+            if (participant_id not in self._removed and
+                    participant_id not in self._added):
+                yield participant_id, public_key
+        for item in self._added.items():
+            yield item
+
+    def __iter__(self):
+        for participant_id, _ in self.items():
+            yield participant_id
+
+    def __len__(self):
+        """
+        The number of participants. This has to scan the store.
+        """
+        return sum(1 for _ in self.items())
+
+    def compact(self):
+        """
+        Merge the log into the main file, and empty the log.
+
+        The new main file is written and flushed to disk next to the old one,
+        and renamed over it, so a crash while compacting leaves the store
+        intact.
+        """
+        records = sorted(self.items())
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as outfile:
+            outfile.write(_HEADER.pack(_MAGIC, _VERSION))
+            for participant_id, public_key in records:
+                outfile.write(participant_id + public_key)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        _fsync_directory(temporary_path)
+
+        self._close_main()
+        _replace(temporary_path, self.path)
+        # The log can only be emptied once the new main file is sure to be
+        # in place.
+        _fsync_directory(self.path)
+        self._log.close()
+        self._log = open(self.log_path, "wb")
+        self._added.clear()
+        self._removed.clear()
+        self._open_main()
+
+    def _close_main(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def close(self):
+        """
+        Close the store's files.
+        """
+        self._close_main()
+        self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,31 +1,313 @@
 """
 lasses and methods relating to the topic and its participants.
 """
+import itertools
+import struct
+import threading
+import time
+
+import nacl.exceptions
+import nacl.utils
+
+from .cache import LRUCache
+from .compression import decompress
 from .crypto import (
     PARTICIPANT_ID_LENGTH,
     AsymmetricCrypto,
     Signer,
     SymmetricCrypto,
     Verifier,
+    _as_bytes,
+    _get_encryption_key,
     _get_id_from_key,
     generate_signing_key_seed,
+    generate_topic_key,
 )
 from .exceptions import (
-    IntroductionError, IntroductionReplyError, MissingTopicKeyError,
+    BadSignatureError, IntroductionError, IntroductionReplyError,
+    MalformedMessageError, MissingTopicKeyError, StreamChunkError,
     UntrustedKeyError
 )
+from .merkle import HASH_LENGTH, build_tree, leaf_hash, root_from_proof
+from .metrics import clock
+from .replay import ReplayWindow
+from .store import OverlayParticipantStore
 
 MESSAGE_UNKNOWN = b"u"
 MESSAGE_SIMPLE = b"s"
 MESSAGE_INTRO = b"i"
 MESSAGE_REPLY = b"r"
+MESSAGE_CHUNK = b"c"
+MESSAGE_EXTENDED = b"x"
+MESSAGE_ROTATION = b"k"
+MESSAGE_BATCH_REPLY = b"b"
+MESSAGE_BATCH_SIGNED = b"h"
+MESSAGE_AUTHENTICATED = b"a"
+
+# The default size of the plaintext in each chunk of a stream.
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_STREAM_ID_LENGTH = 8
+_CHUNK_HEADER = struct.Struct(">IB")
+_CHUNK_FINAL = 1
+_CHUNK_EPOCH = 2
+_CHUNK_SEQUENCE = 4
+
+# The flags of extended messages, each of which indicates the presence of an
+# optional field.
+FLAG_SEQUENCE = 0x01
+FLAG_EPOCH = 0x02
+FLAG_COMPRESSED = 0x04
+_SUPPORTED_FLAGS = FLAG_SEQUENCE | FLAG_EPOCH | FLAG_COMPRESSED
+_EXTENDED_HEADER_LENGTH = 65 + PARTICIPANT_ID_LENGTH + 1
+_FLAGS = struct.Struct(">B")
+_SEQUENCE = struct.Struct(">Q")
+_EPOCH = struct.Struct(">I")
+
+# Batch-signed messages are extended messages whose signature covers the root
+# of a Merkle tree over a batch of messages. After the optional fields, each
+# carries its position in the batch, the size of the batch, and the inclusion
+# proof of the message in the tree.
+_PROOF_HEADER = struct.Struct(">HHB")
+_MAX_BATCH_SIZE = 0xffff
+_ROOT_DOMAIN = b"stringphone batch root\0"
+
+# Key rotations and batch replies carry an epoch and the sender's encryption
+# key, followed by one entry of recipient ID and encrypted topic key for each
+# recipient, sorted by recipient ID.
+_ROTATION_HEADER_LENGTH = 65 + PARTICIPANT_ID_LENGTH + _EPOCH.size + 32
+_BATCH_REPLY_HEADER_LENGTH = 65 + 32 + _EPOCH.size + 32
+_ENCRYPTED_KEY_LENGTH = 72
+_ENTRY_LENGTH = PARTICIPANT_ID_LENGTH + _ENCRYPTED_KEY_LENGTH
+
+# The types of messages that are signed (or authenticated with a code of the
+# same length), and start with the signature and the sender's ID.
+_SIGNED_TYPES = frozenset((
+    MESSAGE_SIMPLE, MESSAGE_CHUNK, MESSAGE_EXTENDED, MESSAGE_ROTATION,
+    MESSAGE_BATCH_SIGNED, MESSAGE_AUTHENTICATED
+))
+
+# Topic snapshots start with a header of magic, version and flags, which say
+# which of the optional sections follow.
+_SNAPSHOT_MAGIC = b"SPSN"
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct(">4sBB")
+_SNAPSHOT_TOPIC_KEY = 0x01
+_SNAPSHOT_PARTICIPANTS = 0x02
+_SNAPSHOT_REPLAY = 0x04
+_SNAPSHOT_EPOCH = 0x08
+_SNAPSHOT_COUNT = struct.Struct(">I")
+_SNAPSHOT_REPLAY_STATE = struct.Struct(">QQ")
+_KEY_LENGTH = 32
+
+# The offset of the sender's public key in the types of messages that are
+# identified by it.
+_SENDER_KEY_OFFSETS = {
+    MESSAGE_INTRO: 1,
+    MESSAGE_REPLY: 121,
+    MESSAGE_BATCH_REPLY: 65,
+}
+
+# The minimum length of each type of message, i.e. the length of everything
+# but its variable-length payload.
+_MINIMUM_LENGTHS = {
+    MESSAGE_SIMPLE: 65 + PARTICIPANT_ID_LENGTH,
+    MESSAGE_INTRO: 129,
+    MESSAGE_REPLY: 153,
+    MESSAGE_CHUNK: (
+        65 + PARTICIPANT_ID_LENGTH + _STREAM_ID_LENGTH + _CHUNK_HEADER.size
+    ),
+    MESSAGE_EXTENDED: _EXTENDED_HEADER_LENGTH,
+    MESSAGE_ROTATION: _ROTATION_HEADER_LENGTH,
+    MESSAGE_BATCH_REPLY: _BATCH_REPLY_HEADER_LENGTH,
+    MESSAGE_BATCH_SIGNED: _EXTENDED_HEADER_LENGTH + _PROOF_HEADER.size,
+    MESSAGE_AUTHENTICATED: _EXTENDED_HEADER_LENGTH,
+}
+
+
+def _read_field(message, offset, field):
+    """
+    Read a fixed-size field from a message header.
+
+    :param message: The raw message, as anything that supports slicing.
+    :param int offset: The offset of the field.
+    :param struct.Struct field: The format of the field.
+    :returns: The value of the field, and the offset right after it.
+    :raises MalformedMessageError: if the message ends before the field does.
+    """
+    end = offset + field.size
+    if len(message) < end:
+        raise MalformedMessageError("The message is truncated.")
+    return field.unpack(_as_bytes(message[offset:end]))[0], end
+
+
+def _check_entries(message, header_length):
+    """
+    Make sure the rest of a message after its header is made of whole
+    entries.
+
+    :raises MalformedMessageError: if the last entry is truncated.
+    """
+    if (len(message) - header_length) % _ENTRY_LENGTH:
+        raise MalformedMessageError("The message is truncated.")
 
 
-class Message(bytes):
+class _Header(object):
+    """
+    The parsed header of a message.
+
+    The sender ID of the signed types is not part of it, as it is always in
+    the same place, and reading it doesn't need the rest of the header.
+    """
+    __slots__ = (
+        "type", "sender_id", "sequence", "epoch", "codec", "proof_offset",
+        "payload_offset",
+    )
+
     def __init__(self, message):
-        # This is a subclass of bytes, so we want to make sure it
-        # acts like one in every circumstance.
-        self = message  # noqa
+        """
+        Parse the header of a message.
+
+        :param message: The raw message, as anything that supports slicing.
+        :raises MalformedMessageError: if the message is too short for its
+            type.
+        """
+        message_type = _as_bytes(message[0:1])
+        self.sender_id = None
+        self.sequence = None
+        self.epoch = None
+        self.codec = None
+        self.proof_offset = None
+        self.payload_offset = None
+        if message_type not in _MINIMUM_LENGTHS:
+            self.type = MESSAGE_UNKNOWN
+            return
+
+        if len(message) < _MINIMUM_LENGTHS[message_type]:
+            raise MalformedMessageError("The message is truncated.")
+
+        self.type = message_type
+        self._PARSERS[message_type](self, message)
+
+    def _parse_simple(self, message):
+        self.payload_offset = 81
+
+    def _parse_chunk(self, message):
+        offset = _MINIMUM_LENGTHS[MESSAGE_CHUNK]
+        flags = bytearray(message[offset - 1:offset])[0]
+        if flags & _CHUNK_SEQUENCE:
+            self.sequence, offset = _read_field(message, offset, _SEQUENCE)
+        if flags & _CHUNK_EPOCH:
+            self.epoch, offset = _read_field(message, offset, _EPOCH)
+        self.payload_offset = offset
+
+    def _parse_extended(self, message):
+        """
+        Parse the optional fields of an extended message.
+        """
+        flags = bytearray(message[81:82])[0]
+        if flags & ~_SUPPORTED_FLAGS:
+            raise MalformedMessageError("The message has unsupported flags.")
+
+        offset = _EXTENDED_HEADER_LENGTH
+        if flags & FLAG_SEQUENCE:
+            self.sequence, offset = _read_field(message, offset, _SEQUENCE)
+        if flags & FLAG_EPOCH:
+            self.epoch, offset = _read_field(message, offset, _EPOCH)
+        if flags & FLAG_COMPRESSED:
+            self.codec, offset = _read_field(message, offset, _FLAGS)
+        self.payload_offset = offset
+
+    def _parse_batch_signed(self, message):
+        self._parse_extended(message)
+        offset = self.proof_offset = self.payload_offset
+        end = offset + _PROOF_HEADER.size
+        if len(message) >= end:
+            proof_length = bytearray(message[end - 1:end])[0]
+            end += proof_length * HASH_LENGTH
+        if len(message) < end:
+            raise MalformedMessageError("The message is truncated.")
+        self.payload_offset = end
+
+    def _parse_rotation(self, message):
+        self.epoch = _EPOCH.unpack(_as_bytes(message[81:85]))[0]
+        _check_entries(message, _ROTATION_HEADER_LENGTH)
+
+    def _parse_batch_reply(self, message):
+        self.sender_id = _get_id_from_key(message[65:97])
+        self.epoch = _EPOCH.unpack(_as_bytes(message[97:101]))[0]
+        _check_entries(message, _BATCH_REPLY_HEADER_LENGTH)
+
+    def _parse_intro(self, message):
+        self.sender_id = _get_id_from_key(message[1:33])
+
+    def _parse_reply(self, message):
+        self.sender_id = _get_id_from_key(message[121:153])
+        # Replies from topics whose key has been rotated carry the epoch.
+        if len(message) >= 153 + _EPOCH.size:
+            self.epoch = _EPOCH.unpack(_as_bytes(message[153:157]))[0]
+
+    # The parser of the rest of the header, for each type of message.
+    _PARSERS = {
+        MESSAGE_SIMPLE: _parse_simple,
+        MESSAGE_INTRO: _parse_intro,
+        MESSAGE_REPLY: _parse_reply,
+        MESSAGE_CHUNK: _parse_chunk,
+        MESSAGE_EXTENDED: _parse_extended,
+        MESSAGE_ROTATION: _parse_rotation,
+        MESSAGE_BATCH_REPLY: _parse_batch_reply,
+        MESSAGE_BATCH_SIGNED: _parse_batch_signed,
+        MESSAGE_AUTHENTICATED: _parse_extended,
+    }
+
+
+# The headers of simple messages are all the same, so they share this one.
+_SIMPLE_HEADER = _Header(
+    MESSAGE_SIMPLE.ljust(_MINIMUM_LENGTHS[MESSAGE_SIMPLE], b"\0")
+)
+
+
+def _parse_header(message):
+    """
+    Parse the header of a message.
+
+    :param message: The raw message, as anything that supports slicing.
+    :rtype: _Header
+    :raises MalformedMessageError: if the message is too short for its
+        type.
+    """
+    if message[0:1] == MESSAGE_SIMPLE:
+        # This is the most common type of message, and has no optional
+        # fields.
+        if len(message) < _MINIMUM_LENGTHS[MESSAGE_SIMPLE]:
+            raise MalformedMessageError("The message is truncated.")
+        return _SIMPLE_HEADER
+    return _Header(message)
+
+
+class _LazyHeader(object):
+    """
+    Parse the header of a message the first time it is read.
+
+    The header is then stored on the message, which takes precedence over
+    this descriptor, so later reads are plain attribute lookups.
+    """
+
+    def __get__(self, message, owner):
+        if message is None:
+            return self
+        header = message._header = _parse_header(message)
+        return header
+
+
+class _MessageFields(object):
+    """
+    The fields of a message. Subclasses provide the storage by implementing
+    slicing, which this uses to extract each field, and parse the header into
+    `_header` the first time a field that needs it is read, so messages that
+    are only routed by their sender don't pay for it.
+    """
+    __slots__ = ()
 
     @property
     def type(self):
@@ -34,10 +316,7 @@ class Message(bytes):
 
         :rtype: int
         """
-        for message_type in (MESSAGE_SIMPLE, MESSAGE_INTRO, MESSAGE_REPLY):
-            if self.startswith(message_type):
-                return message_type
-        return MESSAGE_UNKNOWN
+        return self._header.type
 
     @property
     def signed_payload(self):
@@ -48,7 +327,11 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type != MESSAGE_SIMPLE:
+        message_type = self._header.type
+        if (message_type == MESSAGE_BATCH_SIGNED or
+                message_type == MESSAGE_AUTHENTICATED or
+                message_type not in _SIGNED_TYPES and
+                message_type != MESSAGE_BATCH_REPLY):
             raise ValueError("Message is of the wrong type for this property.")
         return self[1:]
 
@@ -61,9 +344,82 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type != MESSAGE_SIMPLE:
+        payload_offset = self._header.payload_offset
+        if payload_offset is None:
+            raise ValueError("Message is of the wrong type for this property.")
+        return self[payload_offset:]
+
+    @property
+    def sequence(self):
+        """
+        The sequence number of the message, or `None` if it doesn't have one.
+
+        :rtype: int
+        :raises ValueError: if the given message type does not have this
+            property.
+        """
+        if self._header.payload_offset is None:
+            raise ValueError("Message is of the wrong type for this property.")
+        return self._header.sequence
+
+    @property
+    def epoch(self):
+        """
+        The epoch of the topic key the message was sent with, or `None` if
+        it isn't tagged with one.
+
+        :rtype: int
+        :raises ValueError: if the given message type does not have this
+            property.
+        """
+        if self._header.type in (MESSAGE_INTRO, MESSAGE_UNKNOWN):
             raise ValueError("Message is of the wrong type for this property.")
-        return self[65 + PARTICIPANT_ID_LENGTH:]
+        return self._header.epoch
+
+    @property
+    def stream_id(self):
+        """
+        The ID of the stream a chunk belongs to.
+
+        :rtype: bytes
+        :raises ValueError: if the given message type does not have this
+            property.
+        """
+        if self._header.type == MESSAGE_CHUNK:
+            return self[81:81 + _STREAM_ID_LENGTH]
+        else:
+            raise ValueError("Message is of the wrong type for this property.")
+
+    @property
+    def chunk_index(self):
+        """
+        The position of a chunk in its stream, starting from zero.
+
+        :rtype: int
+        :raises ValueError: if the given message type does not have this
+            property.
+        """
+        return self._chunk_header[0]
+
+    @property
+    def last_chunk(self):
+        """
+        Whether this chunk is the last one in its stream.
+
+        :rtype: bool
+        :raises ValueError: if the given message type does not have this
+            property.
+        """
+        return bool(self._chunk_header[1] & _CHUNK_FINAL)
+
+    @property
+    def _chunk_header(self):
+        if self._header.type != MESSAGE_CHUNK:
+            raise ValueError("Message is of the wrong type for this property.")
+        start = 81 + _STREAM_ID_LENGTH
+        return _CHUNK_HEADER.unpack(
+            _as_bytes(self[start:start + _CHUNK_HEADER.size])
+        )
 
     @property
     def encrypted_topic_key(self):
@@ -74,7 +430,7 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type == MESSAGE_REPLY:
+        if self._header.type == MESSAGE_REPLY:
             return self[17:89]
         else:
             raise ValueError("Message is of the wrong type for this property.")
@@ -88,7 +444,7 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type == MESSAGE_REPLY:
+        if self._header.type == MESSAGE_REPLY:
             return self[1:17]
         else:
             raise ValueError("Message is of the wrong type for this property.")
@@ -102,14 +458,15 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type == MESSAGE_SIMPLE:
-            return self[65:81]
-        elif self.type == MESSAGE_INTRO:
-            return _get_id_from_key(self.sender_key)
-        elif self.type == MESSAGE_REPLY:
-            return _get_id_from_key(self.sender_key)
-        else:
+        message_type = _as_bytes(self[0:1])
+        if message_type in _SIGNED_TYPES:
+            if len(self) < _MINIMUM_LENGTHS[message_type]:
+                raise MalformedMessageError("The message is truncated.")
+            return _as_bytes(self[65:81])
+        sender_id = self._header.sender_id
+        if sender_id is None:
             raise ValueError("Message is of the wrong type for this property.")
+        return sender_id
 
     @property
     def sender_key(self):
@@ -120,12 +477,15 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type == MESSAGE_SIMPLE:
+        message_type = self._header.type
+        if message_type == MESSAGE_SIMPLE:
             return self[65:81]
-        elif self.type == MESSAGE_INTRO:
+        elif message_type == MESSAGE_INTRO:
             return self[1:33]
-        elif self.type == MESSAGE_REPLY:
+        elif message_type == MESSAGE_REPLY:
             return self[121:153]
+        elif message_type == MESSAGE_BATCH_REPLY:
+            return self[65:97]
         else:
             raise ValueError("Message is of the wrong type for this property.")
 
@@ -138,10 +498,15 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type == MESSAGE_INTRO:
+        message_type = self._header.type
+        if message_type == MESSAGE_INTRO:
             return self[33:]
-        elif self.type == MESSAGE_REPLY:
+        elif message_type == MESSAGE_REPLY:
             return self[89:121]
+        elif message_type == MESSAGE_ROTATION:
+            return self[85:117]
+        elif message_type == MESSAGE_BATCH_REPLY:
+            return self[101:133]
         else:
             raise ValueError("Message is of the wrong type for this property.")
 
@@ -154,12 +519,209 @@ class Message(bytes):
         :raises ValueError: if the given message type does not have this
             property.
         """
-        if self.type == MESSAGE_INTRO:
+        if self._header.type == MESSAGE_INTRO:
             return self[33:]
         else:
             raise ValueError("Message is of the wrong type for this property.")
 
 
+class Message(_MessageFields, bytes):
+    """
+    A message. This is a subclass of `bytes`, with properties for the fields
+    of the message.
+
+    The message is validated when its fields are first read, which raises
+    `MalformedMessageError` if it is truncated.
+    """
+    _header = _LazyHeader()
+
+
+class MessageView(_MessageFields):
+    """
+    A zero-copy view of a message.
+
+    This exposes the same fields as `Message`, but wraps the given buffer
+    instead of copying it, and every field except the (short) sender ID is a
+    `memoryview` slice of that buffer. This is useful for large messages, or
+    for buffers owned by the transport (such as the `bytearray` payloads
+    paho-mqtt delivers), as the message can be parsed and routed without
+    copying the payload.
+
+    While the view exists, the underlying buffer cannot be resized. Call
+    `release` when you are done with it, after which it must not be used.
+    """
+    __slots__ = ("_view", "_parsed")
+
+    def __init__(self, buffer):
+        """
+        :param buffer: Any object that supports the buffer protocol, such as
+            `bytes`, `bytearray` or `memoryview`.
+        """
+        self._view = memoryview(buffer)
+        self._parsed = None
+
+    @property
+    def _header(self):
+        header = self._parsed
+        if header is None:
+            header = self._parsed = _parse_header(self._view)
+        return header
+
+    def __getitem__(self, key):
+        return self._view[key]
+
+    def __len__(self):
+        return len(self._view)
+
+    def __bytes__(self):
+        return self._view.tobytes()
+
+    def tobytes(self):
+        """
+        Copy the message into a new `Message`.
+
+        :rtype: Message
+        """
+        return Message(self._view.tobytes())
+
+    def release(self):
+        """
+        Release the underlying buffer.
+        """
+        self._view.release()
+
+
+def _pack_records(records):
+    """
+    Pack a sequence of fixed-width records, or of tuples of fixed-width
+    fields, for a snapshot, prefixed with their count.
+    """
+    records = [
+        record if isinstance(record, bytes) else b"".join(record)
+        for record in records
+    ]
+    return _SNAPSHOT_COUNT.pack(len(records)) + b"".join(records)
+
+
+class _SnapshotReader(object):
+    """
+    Read the fields of a snapshot in order, checking that it is long enough.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = _as_bytes(snapshot)
+        self._offset = 0
+
+    def read(self, length):
+        end = self._offset + length
+        if end > len(self._snapshot):
+            raise ValueError("The snapshot is truncated.")
+        data = self._snapshot[self._offset:end]
+        self._offset = end
+        return data
+
+    def unpack(self, structure):
+        return structure.unpack(self.read(structure.size))
+
+    def records(self, *lengths):
+        """
+        Read a count-prefixed sequence of records, returning the fields of
+        each if there is more than one.
+        """
+        count, = self.unpack(_SNAPSHOT_COUNT)
+        data = self.read(count * sum(lengths))
+        records = []
+        offset = 0
+        for _ in range(count):
+            fields = []
+            for length in lengths:
+                fields.append(data[offset:offset + length])
+                offset += length
+            records.append(tuple(fields) if len(fields) > 1 else fields[0])
+        return records
+
+    def finish(self):
+        if self._offset != len(self._snapshot):
+            raise ValueError("The snapshot has trailing data.")
+
+
+def _verify_intros(messages):
+    """
+    Verify a batch of introductions, skipping the invalid ones.
+
+    :param messages: An iterable of raw messages.
+    :returns: An iterator of the sender ID and encryption key of every
+        distinct introduction with a valid signature.
+    """
+    seen = set()
+    for message in messages:
+        try:
+            message = _as_message(message)
+            if message.type != MESSAGE_INTRO or message.sender_id in seen:
+                continue
+        except MalformedMessageError:
+            continue
+        try:
+            encryption_key = Verifier(message.sender_key).verify(
+                message.signed_encryption_key
+            )
+        except BadSignatureError:
+            continue
+        seen.add(message.sender_id)
+        yield message.sender_id, encryption_key
+
+
+def _find_entry(message, header_length, recipient_id):
+    """
+    Binary search the sorted entries of a multi-recipient message for the
+    entry of a recipient.
+
+    :param Message message: The message.
+    :param int header_length: The length of the message before the entries.
+    :param bytes recipient_id: The ID of the recipient.
+    :returns: The encrypted topic key of the entry, or `None` if there is no
+        entry for the recipient.
+    """
+    low = 0
+    high = (len(message) - header_length) // _ENTRY_LENGTH
+    while low < high:
+        middle = (low + high) // 2
+        offset = header_length + middle * _ENTRY_LENGTH
+        current = _as_bytes(message[offset:offset + PARTICIPANT_ID_LENGTH])
+        if current < recipient_id:
+            low = middle + 1
+        elif current > recipient_id:
+            high = middle
+        else:
+            offset += PARTICIPANT_ID_LENGTH
+            return message[offset:offset + _ENCRYPTED_KEY_LENGTH]
+    return None
+
+
+def _duplicate_key(message):
+    """
+    Return the key that identifies a signed message in the duplicate cache.
+
+    This is usually the signature, but the messages of a signed batch share
+    one, so those are told apart by the end of their ciphertext, which is
+    unique to each.
+    """
+    if message[0:1] == MESSAGE_BATCH_SIGNED:
+        return _as_bytes(message[1:65]) + _as_bytes(message[-16:])
+    return _as_bytes(message[1:65])
+
+
+def _as_message(message):
+    """
+    Parse a raw message, unless it has already been parsed.
+
+    :rtype: Message or MessageView
+    """
+    if isinstance(message, _MessageFields):
+        return message
+    return Message(message)
+
+
 class Topic(object):
     """
     A topic is the main avenue of communication. It can be any one-to-many
@@ -167,11 +729,34 @@ class Topic(object):
     (one-to-one is a subset of one-to-many communication).
     """
 
+    # __dict__ and __weakref__ keep topics usable the way they were before
+    # they had slots, e.g. with attributes set by applications or in weak
+    # references. The dict is only allocated if it is used.
+    __slots__ = (
+        "_metrics", "_event_callback", "_replay", "_sequence", "_recent",
+        "_participants", "_verifiers", "_asymmetric_crypto", "_key_state",
+        "_signer", "_public_key", "_id",
+        "_previous_keys", "_roots", "_mac_authentication", "_compressor",
+        "_nonce_source", "_key_lock", "__dict__", "__weakref__",
+    )
+
     def __init__(
         self,
         signing_key_seed=None,
         topic_key=None,
-        participants=None
+        participants=None,
+        verifier_cache_size=None,
+        metrics=None,
+        event_callback=None,
+        replay_window=None,
+        replay_senders=4096,
+        duplicate_cache_size=None,
+        key_history=4,
+        batch_root_cache_size=256,
+        mac_authentication=False,
+        compression=None,
+        nonce_source=None,
+        encryption_private_key=None
     ):
         """
         Various amounts of state can be passed to initialize according to each
@@ -197,6 +782,87 @@ class Topic(object):
             participants. This should have the form
             {b"participant_id": b"participant_key"}. Participant keys in this
             dictionary will be trusted when verifying messages signed with them.
+            This can also be a :py:class:`ParticipantStore
+            <stringphone.store.ParticipantStore>`, such as a
+            :py:class:`MappedParticipantStore
+            <stringphone.store.MappedParticipantStore>` for very large rosters,
+            in which case participants added or removed through the topic are
+            persisted in the store.
+        :param int verifier_cache_size: The optional maximum number of
+            participant verifiers to keep around. Verifiers are expensive to
+            construct, so one is cached for every trusted participant. For
+            topics with very large rosters, set this to evict the least
+            recently used verifiers; evicted verifiers will be reconstructed
+            the next time they are needed.
+        :param MetricsSink metrics: The optional sink to report counters and
+            timings of the topic's operations to. See
+            :py:mod:`stringphone.metrics`.
+        :param event_callback: The optional function to notify of messages
+            that are silently dropped while decoding. It is called with the
+            name of the event and the raw message. The events are
+            "self_echo", for messages we sent ourselves, and
+            "untrusted_dropped", for messages from untrusted participants
+            when `ignore_untrusted` is set, "replay_dropped", for replayed
+            messages, "unsequenced_dropped", for messages without a sequence
+            number when replay protection is enabled, and
+            "duplicate_dropped", for duplicate messages.
+        :param int replay_window: If this is set, replay protection is
+            enabled. Encoded messages carry a sequence number, and received
+            messages are dropped if their sequence number has been seen
+            before, or if it is more than `replay_window` (at most 64) behind
+            the highest one seen from the sender. Received messages without a
+            sequence number are always dropped, as there is no way to tell
+            whether they are replayed, so every sender has to enable replay
+            protection too. Sequence numbers start from
+            the current time in microseconds, so they keep increasing across
+            restarts as long as fewer than a million messages are sent per
+            second.
+        :param int replay_senders: The maximum number of senders to track for
+            replay protection. See :py:class:`ReplayWindow
+            <stringphone.replay.ReplayWindow>`.
+        :param int duplicate_cache_size: If this is set, the signatures of
+            this many recently decoded messages are remembered, and messages
+            with the same signature are dropped without being verified or
+            decrypted. Brokers with at-least-once delivery semantics can
+            deliver the same message many times, and this discards the
+            duplicates cheaply, even without replay protection.
+        :param int key_history: The number of previous topic keys to keep
+            after the key is rotated, so that messages that were sent with
+            them before the rotation reached their senders can still be
+            decoded. See :py:meth:`rotate_key`.
+        :param int batch_root_cache_size: The number of verified batch
+            signatures to remember. The messages of a batch signed with
+            `encode_many(..., batch_sign=True)` share one signature, so only
+            the first message of a batch to arrive is verified with it, and
+            the rest only need a few hashes.
+        :param bool mac_authentication: If `True`, encoded messages are
+            authenticated with a keyed BLAKE2b code derived from the topic key
+            instead of being signed, which makes encoding and decoding them
+            much cheaper. **The code only proves that the sender knows the
+            topic key**, so any participant can forge messages that appear
+            to come from any other participant. Only use this on closed
+            topics whose participants all trust each other. Authenticated
+            messages are only accepted by topics that set this, and signed
+            messages are always accepted, so participants can switch
+            gradually. Streams and batch-signed messages are still signed.
+        :param Compressor compression: The optional compression settings.
+            If this is set, payloads are compressed before they are
+            encrypted. Compressed messages are decoded regardless of this,
+            but their size is limited, and messages compressed with a preset
+            dictionary need the same dictionary here. See
+            :py:mod:`stringphone.compression`. Streams are not compressed.
+        :param NonceSource nonce_source: The optional source of the nonces
+            to encrypt messages with. By default, every nonce is drawn from
+            the operating system's random source, which is a large part of
+            the cost of encoding small messages. A
+            :py:class:`CounterNonceSource
+            <stringphone.crypto.CounterNonceSource>` or
+            :py:class:`BufferedNonceSource
+            <stringphone.crypto.BufferedNonceSource>` is much cheaper.
+        :param bytes encryption_private_key: The optional private key of our
+            ephemeral encryption key, which is generated if this is not
+            provided. :py:meth:`restore` uses this to resume a pending
+            introduction.
         """
         if signing_key_seed is None:
             signing_key_seed = generate_signing_key_seed()
@@ -204,12 +870,92 @@ class Topic(object):
         if participants is None:
             participants = {}
 
-        self._participants = participants
-        self._asymmetric_crypto = AsymmetricCrypto()
+        self._metrics = metrics
+        self._event_callback = event_callback
+        self._nonce_source = nonce_source
+        self._init_state(
+            topic_key, participants, replay_window, replay_senders,
+            duplicate_cache_size, key_history, mac_authentication, compression
+        )
+        self._sequence = itertools.count(int(time.time() * 1000000))
+        self._roots = LRUCache(batch_root_cache_size)
+        self._verifiers = LRUCache(verifier_cache_size)
+        if isinstance(participants, dict):
+            # Stores are meant for rosters too large to load at startup, so
+            # their verifiers are only constructed when first needed.
+            for participant_id, public_key in participants.items():
+                self._verifiers[participant_id] = Verifier(public_key)
+        self._asymmetric_crypto = AsymmetricCrypto(
+            private_key=encryption_private_key
+        )
 
-        self.topic_key = topic_key
         self._signer = Signer(signing_key_seed)
-        self._id = _get_id_from_key(self._signer.public_key)
+        self._public_key = self._signer.public_key
+        self._id = _get_id_from_key(self._public_key)
+
+    def _init_state(
+        self, topic_key, participants, replay_window, replay_senders,
+        duplicate_cache_size, key_history, mac_authentication, compression
+    ):
+        """
+        Initialize the state that belongs to this topic alone, as opposed to
+        our identity and caches, which can be shared between topics.
+        """
+        self._mac_authentication = mac_authentication
+        self._compressor = compression
+        # The current epoch, topic key and symmetric crypto. They are only
+        # ever replaced together, so reading the tuple once gives a
+        # consistent view while other threads rotate the key.
+        self._key_state = (0, None, None)
+        # Serializes the changes to the key state.
+        self._key_lock = threading.Lock()
+        if key_history:
+            self._previous_keys = LRUCache(key_history)
+        else:
+            self._previous_keys = None
+        self.topic_key = topic_key
+        self._participants = participants
+        if replay_window is None:
+            self._replay = None
+        else:
+            self._replay = ReplayWindow(replay_window, replay_senders)
+        if duplicate_cache_size is None:
+            self._recent = None
+        else:
+            self._recent = LRUCache(duplicate_cache_size)
+
+    def _derive(
+        self, topic_key=None, participants=None, replay_window=None,
+        replay_senders=4096, duplicate_cache_size=None, key_history=4,
+        mac_authentication=False, compression=None
+    ):
+        """
+        Create a topic that shares our identity, sequence numbers, metrics and
+        caches, but has its own topic key, participants and replay state.
+
+        The verifier cache is shared, so verifiers for the participants of the
+        new topic are only constructed when first needed. If `participants`
+        is `None`, the new topic sees our participants through an
+        :py:class:`OverlayParticipantStore
+        <stringphone.store.OverlayParticipantStore>`, so participants it adds
+        or removes don't affect us or other derived topics.
+
+        :rtype: Topic
+        """
+        topic = Topic.__new__(Topic)
+        for name in (
+            "_metrics", "_event_callback", "_sequence", "_verifiers", "_roots",
+            "_asymmetric_crypto", "_signer", "_public_key", "_id",
+            "_nonce_source",
+        ):
+            setattr(topic, name, getattr(self, name))
+        if participants is None:
+            participants = OverlayParticipantStore(self._participants)
+        topic._init_state(
+            topic_key, participants, replay_window, replay_senders,
+            duplicate_cache_size, key_history, mac_authentication, compression
+        )
+        return topic
 
     #########
     # Various properties
@@ -230,7 +976,7 @@ class Topic(object):
 
         :rtype: bytes
         """
-        return self._signer.public_key
+        return self._public_key
 
     @property
     def topic_key(self):
@@ -239,7 +985,7 @@ class Topic(object):
 
         :rtype: bytes
         """
-        return self._topic_key
+        return self._key_state[1]
 
     @topic_key.setter
     def topic_key(self, value):
@@ -248,13 +994,41 @@ class Topic(object):
         None if unknown. If we don't know the topic key yet, we must perform an
         introduction and hope one of the other participants sends it to us.
 
+        This replaces the key of the current epoch and forgets the previous
+        keys. Use :py:meth:`rotate_key` to change the key of a running topic.
+
         :param bytes value: The symmetric key of the topic, or None.
         """
-        self._topic_key = value
-        if value is None:
-            self._symmetric_crypto = None
+        self._reset_key(value)
+
+    def _reset_key(self, topic_key, epoch=None):
+        """
+        Replace the current key and forget the previous keys.
+
+        :param bytes topic_key: The new topic key, or `None`.
+        :param int epoch: The epoch of the new key, or `None` to keep the
+            current epoch.
+        """
+        if topic_key is None:
+            symmetric_crypto = None
         else:
-            self._symmetric_crypto = SymmetricCrypto(value)
+            symmetric_crypto = SymmetricCrypto(topic_key, self._nonce_source)
+        with self._key_lock:
+            if self._previous_keys is not None:
+                self._previous_keys.clear()
+            if epoch is None:
+                epoch = self._key_state[0]
+            self._key_state = (epoch, topic_key, symmetric_crypto)
+
+    @property
+    def epoch(self):
+        """
+        The epoch of the topic key, i.e. the number of times it has been
+        rotated.
+
+        :rtype: int
+        """
+        return self._key_state[0]
 
     #########
     # Participant methods
@@ -265,7 +1039,9 @@ class Topic(object):
 
         :param bytes public_key: The public key of the participant to add.
         """
-        self._participants[_get_id_from_key(public_key)] = public_key
+        participant_id = _get_id_from_key(public_key)
+        self._participants[participant_id] = public_key
+        self._verifiers[participant_id] = Verifier(public_key)
 
     def remove_participant(self, participant_id):
         """
@@ -274,6 +1050,9 @@ class Topic(object):
         :param bytes participant_id: The ID of the participant to remove.
         """
         del self._participants[participant_id]
+        self._verifiers.pop(participant_id)
+        if self._replay is not None:
+            self._replay.forget(participant_id)
 
     def participants(self):
         """
@@ -283,6 +1062,230 @@ class Topic(object):
         """
         return self._participants
 
+    #########
+    # Persistence methods
+    #
+    def snapshot(self):
+        """
+        Export the state of the topic, so that a restarted process can resume
+        where this one left off with :py:meth:`restore`, without
+        re-introducing itself to the topic.
+
+        The snapshot contains our signing key seed, the topic key, the
+        trusted participants (unless they are kept in a participant store,
+        which persists itself), the encryption key of a pending introduction,
+        the replay protection state, the previous topic keys that are still
+        kept after a rotation, and the keys of the warm caches, so they can
+        be rebuilt before traffic arrives.
+
+        **The snapshot contains our secret keys**, so store it as securely as
+        the signing key seed.
+
+        :returns: The snapshot.
+        :rtype: bytes
+        """
+        epoch, topic_key, _ = self._key_state
+        flags = 0
+        sections = []
+        if topic_key is not None:
+            flags |= _SNAPSHOT_TOPIC_KEY
+            sections.append(topic_key)
+        # Consuming a sequence number guarantees that the restored topic
+        # never reuses one we have sent.
+        sections.append(_SEQUENCE.pack(next(self._sequence)))
+        if isinstance(self._participants, (dict, OverlayParticipantStore)):
+            flags |= _SNAPSHOT_PARTICIPANTS
+            sections.append(_pack_records(sorted(self._participants.items())))
+        sections.append(_pack_records(self._verifiers.keys()))
+        sections.append(_pack_records(self._asymmetric_crypto.cached_keys()))
+        if self._replay is not None:
+            flags |= _SNAPSHOT_REPLAY
+            sections.append(_pack_records(
+                (sender_id, _SNAPSHOT_REPLAY_STATE.pack(highest, seen))
+                for sender_id, highest, seen in self._replay.export()
+            ))
+        if epoch:
+            flags |= _SNAPSHOT_EPOCH
+            sections.append(_EPOCH.pack(epoch))
+            previous_keys = self._previous_keys
+            sections.append(_pack_records(
+                (_EPOCH.pack(previous), previous_keys.get(previous).key)
+                for previous in (
+                    previous_keys.keys() if previous_keys is not None else ()
+                )
+            ))
+
+        return b"".join([
+            _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, flags),
+            self._signer.private_key,
+            self._asymmetric_crypto.private_key,
+        ] + sections)
+
+    @classmethod
+    def restore(cls, snapshot, **kwargs):
+        """
+        Create a topic from a snapshot returned by :py:meth:`snapshot`.
+
+        The snapshot does not include the topic's configuration, so pass the
+        same keyword arguments the original topic was created with (except
+        for the keys and participants, which come from the snapshot). If
+        `participants` is passed, it is used instead of the participants in
+        the snapshot.
+
+        :param bytes snapshot: The snapshot.
+        :returns: The restored topic.
+        :rtype: Topic
+        :raises ValueError: if the snapshot is invalid.
+        """
+        reader = _SnapshotReader(snapshot)
+        magic, version, flags = reader.unpack(_SNAPSHOT_HEADER)
+        if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+            raise ValueError("The snapshot has an unknown format.")
+
+        signing_key_seed = reader.read(_KEY_LENGTH)
+        encryption_key = reader.read(_KEY_LENGTH)
+        topic_key = None
+        if flags & _SNAPSHOT_TOPIC_KEY:
+            topic_key = reader.read(_KEY_LENGTH)
+        sequence, = reader.unpack(_SEQUENCE)
+        participants = None
+        if flags & _SNAPSHOT_PARTICIPANTS:
+            participants = dict(
+                reader.records(PARTICIPANT_ID_LENGTH, _KEY_LENGTH)
+            )
+        warm_verifiers = reader.records(PARTICIPANT_ID_LENGTH)
+        warm_boxes = reader.records(_KEY_LENGTH)
+        replay_state = None
+        if flags & _SNAPSHOT_REPLAY:
+            replay_state = [
+                (sender_id,) + _SNAPSHOT_REPLAY_STATE.unpack(state)
+                for sender_id, state in reader.records(
+                    PARTICIPANT_ID_LENGTH, _SNAPSHOT_REPLAY_STATE.size
+                )
+            ]
+        epoch = 0
+        previous_keys = []
+        if flags & _SNAPSHOT_EPOCH:
+            epoch, = reader.unpack(_EPOCH)
+            previous_keys = reader.records(_EPOCH.size, _KEY_LENGTH)
+        reader.finish()
+
+        kwargs.setdefault("participants", participants)
+        topic = cls(
+            signing_key_seed=signing_key_seed, topic_key=topic_key,
+            encryption_private_key=encryption_key, **kwargs
+        )
+        topic._sequence = itertools.count(
+            max(sequence, int(time.time() * 1000000))
+        )
+        if replay_state is not None and topic._replay is not None:
+            topic._replay.load(replay_state)
+        topic._restore_keys(epoch, previous_keys)
+        topic._warm_up(warm_verifiers, warm_boxes)
+        return topic
+
+    def _restore_keys(self, epoch, previous_keys):
+        """
+        Restore the epoch and the previous topic keys from a snapshot.
+
+        :param int epoch: The current epoch.
+        :param list previous_keys: The packed epoch and key of every previous
+            topic key in the snapshot.
+        """
+        self._reset_key(self.topic_key, epoch)
+        if self._previous_keys is None:
+            return
+        for previous_epoch, key in previous_keys:
+            self._previous_keys[_EPOCH.unpack(previous_epoch)[0]] = (
+                SymmetricCrypto(key)
+            )
+
+    def _warm_up(self, participant_ids, public_keys):
+        """
+        Rebuild the verifiers and boxes that were cached when a snapshot was
+        taken.
+
+        :param list participant_ids: The IDs of the cached verifiers.
+        :param list public_keys: The public keys of the cached boxes.
+        """
+        for participant_id in participant_ids:
+            if participant_id in self._participants:
+                self._get_verifier(participant_id)
+        for public_key in public_keys:
+            self._asymmetric_crypto._get_box(public_key)
+
+    def should_process(self, message):
+        """
+        Quickly check whether a raw message is worth decoding, looking only at
+        its type, sender ID and signature.
+
+        This rejects messages of unknown types, messages we sent ourselves,
+        signed messages from untrusted participants and, if
+        `duplicate_cache_size` is set, duplicates of recently decoded
+        messages. It is much cheaper than decoding, so it can be used to
+        discard flood traffic as early as possible. Introductions and replies
+        from others are always worth processing.
+
+        :param bytes message: The raw message from the channel.
+        :rtype: bool
+        """
+        return (
+            _as_bytes(message[0:1]) in _MINIMUM_LENGTHS and
+            self._prefilter(message, False, True) is None
+        )
+
+    def _prefilter(self, message, naive, ignore_untrusted):
+        """
+        Check whether a message should be dropped, without parsing it.
+
+        :param bytes message: The raw message.
+        :returns: The reason the message should be dropped, or `None`.
+        :rtype: str
+        """
+        message_type = _as_bytes(message[0:1])
+        if message_type in _SIGNED_TYPES:
+            sender_id = _as_bytes(message[65:81])
+            if sender_id == self._id:
+                return "self_echo"
+            if (ignore_untrusted and not naive and
+                    sender_id not in self._participants):
+                return "untrusted_dropped"
+            if (self._recent is not None and
+                    _duplicate_key(message) in self._recent):
+                return "duplicate_dropped"
+            return None
+        offset = _SENDER_KEY_OFFSETS.get(message_type)
+        if (offset is not None and
+                message[offset:offset + _KEY_LENGTH] == self._public_key):
+            return "self_echo"
+        return None
+
+    def _drop(self, event, message):
+        """
+        Report a message that is being silently dropped.
+
+        :param str event: The reason the message is dropped.
+        :param bytes message: The raw message.
+        """
+        if self._metrics is not None:
+            self._metrics.increment(event + "_total")
+        if self._event_callback is not None:
+            self._event_callback(event, message)
+
+    def _get_verifier(self, participant_id):
+        """
+        Return the cached verifier for a trusted participant, constructing it
+        if it has been evicted from the cache.
+
+        :param bytes participant_id: The ID of the participant.
+        :rtype: Verifier
+        """
+        verifier = self._verifiers.get(participant_id)
+        if verifier is None:
+            verifier = Verifier(self._participants[participant_id])
+            self._verifiers[participant_id] = verifier
+        return verifier
+
     #########
     # Discovery methods
     #
@@ -309,24 +1312,85 @@ class Topic(object):
         :raises BadSignatureError: if the signature of the encryption key is
             invalid.
         """
-        if not self.topic_key:
+        epoch, topic_key, _ = self._key_state
+        if not topic_key:
             raise RuntimeError(
                 "Cannot construct introduction reply, topic key is unknown."
             )
 
+        metrics = self._metrics
+        if metrics is not None:
+            start = clock()
+
         # The public key of the participant requesting the topic key.
-        message = Message(message)
+        message = _as_message(message)
 
         verifier = Verifier(message.sender_key)
         encryption_key = verifier.verify(message.signed_encryption_key)
 
         encrypted_topic_key = self._asymmetric_crypto.encrypt(
-            self.topic_key, encryption_key
+            topic_key, encryption_key
         )
-        return Message(
+        reply = (
             MESSAGE_REPLY + message.sender_id + encrypted_topic_key +
             self._asymmetric_crypto.public_key + self.public_key
         )
+        if epoch:
+            # Tell the new participant which epoch the topic key is for.
+            reply += _EPOCH.pack(epoch)
+        reply = Message(reply)
+        if metrics is not None:
+            metrics.observe("construct_reply_seconds", clock() - start)
+        return reply
+
+    def construct_reply_batch(self, messages):
+        """
+        Generate a single reply to many introductions. This gives every
+        participant that was introduced **FULL ACCESS** to the topic key and
+        all decrypted messages.
+
+        The reply contains the topic key encrypted to each of the introduced
+        participants, and is signed once, so when many participants join at
+        the same time (e.g. after a fleet restarts) one broadcast replaces a
+        reply per participant. Introductions with invalid signatures are
+        skipped, as are messages that aren't introductions and duplicate
+        introductions.
+
+        :param messages: An iterable of raw introduction messages from the
+            channel.
+        :returns: The reply message to broadcast, or `None` if there was no
+            valid introduction to reply to.
+        :rtype: bytes
+        """
+        epoch, topic_key, _ = self._key_state
+        if not topic_key:
+            raise RuntimeError(
+                "Cannot construct introduction reply, topic key is unknown."
+            )
+
+        metrics = self._metrics
+        if metrics is not None:
+            start = clock()
+
+        asymmetric_crypto = self._asymmetric_crypto
+        entries = {}
+        for sender_id, encryption_key in _verify_intros(messages):
+            entries[sender_id] = asymmetric_crypto.encrypt(
+                topic_key, encryption_key
+            )
+        if not entries:
+            return None
+
+        reply = MESSAGE_BATCH_REPLY + self._signer.sign(b"".join([
+            self.public_key, _EPOCH.pack(epoch),
+            asymmetric_crypto.public_key,
+        ] + [
+            recipient_id + entries[recipient_id]
+            for recipient_id in sorted(entries)
+        ]))
+        if metrics is not None:
+            metrics.observe("construct_reply_batch_seconds", clock() - start)
+        return Message(reply)
 
     def parse_reply(self, message):
         """
@@ -334,22 +1398,154 @@ class Topic(object):
         encrypted topic key that is addressed to us, add it to the topic. If we
         already know the topic key, ignore this message.
 
+        This accepts both single replies and batch replies from
+        :py:meth:`construct_reply_batch`.
+
         :param bytes message: The raw reply message from the channel.
         :returns: Whether the retrieval of the topic key was successful.
         :rtype: bool
+        :raises BadSignatureError: if the signature of a batch reply is
+            invalid.
         """
-        message = Message(message)
-        if self.topic_key or message.recipient_id != self.id:
-            # We already know the topic key or the message wasn't for us,
-            # disregard.
+        message = _as_message(message)
+        if self.topic_key:
+            # We already know the topic key, disregard.
+            return False
+        if message.type == MESSAGE_BATCH_REPLY:
+            Verifier(message.sender_key).verify(message.signed_payload)
+            encrypted_topic_key = _find_entry(
+                message, _BATCH_REPLY_HEADER_LENGTH, self.id
+            )
+            if encrypted_topic_key is None:
+                return False
+        elif message.recipient_id == self.id:
+            encrypted_topic_key = message.encrypted_topic_key
+        else:
+            # The message wasn't for us.
             return False
 
+        metrics = self._metrics
+        if metrics is not None:
+            start = clock()
         topic_key = self._asymmetric_crypto.decrypt(
-            message.encrypted_topic_key, message.encryption_key
+            encrypted_topic_key, message.encryption_key
         )
-        self.topic_key = topic_key
+        self._reset_key(topic_key, message.epoch or 0)
+        if metrics is not None:
+            metrics.observe("parse_reply_seconds", clock() - start)
         return True
 
+    #########
+    # Key rotation methods
+    #
+    def rotate_key(self, topic_key=None):
+        """
+        Replace the topic key with a new one, and generate a message that
+        distributes it to all trusted participants.
+
+        The new key belongs to the next epoch. Messages are tagged with the
+        epoch of the key they were encrypted with, and the previous
+        `key_history` keys are kept, so messages that were in flight during
+        the rotation can still be decoded. Participants apply the rotation
+        when they decode the message; there is no need to introduce
+        ourselves again.
+
+        The new key is encrypted separately to each trusted participant, so
+        the message grows by 88 bytes per participant. Participants that join
+        later receive the current key and epoch in the introduction reply.
+
+        :param bytes topic_key: The new topic key. If this is not provided,
+            one will be generated.
+        :returns: The rotation message to broadcast.
+        :rtype: bytes
+        :raises MissingTopicKeyError: if the topic key is unknown.
+        """
+        epoch, current_key, _ = self._key_state
+        if not current_key:
+            raise MissingTopicKeyError(
+                "Cannot rotate the key without a topic key."
+            )
+        if topic_key is None:
+            topic_key = generate_topic_key()
+
+        epoch += 1
+        asymmetric_crypto = self._asymmetric_crypto
+        entries = []
+        for participant_id, public_key in self._participants.items():
+            if participant_id == self._id:
+                continue
+            entries.append(participant_id + asymmetric_crypto.encrypt(
+                topic_key, _get_encryption_key(public_key)
+            ))
+        entries.sort()
+
+        message = MESSAGE_ROTATION + self._signer.sign(b"".join([
+            self._id, _EPOCH.pack(epoch), asymmetric_crypto.public_key,
+        ] + entries))
+        self._set_key(topic_key, epoch)
+        if self._metrics is not None:
+            self._metrics.increment("key_rotations_total")
+        return Message(message)
+
+    def _set_key(self, topic_key, epoch):
+        """
+        Move to a new epoch, keeping the current key as a previous one.
+
+        :returns: `False` if we have already moved past the epoch.
+        :rtype: bool
+        """
+        symmetric_crypto = SymmetricCrypto(topic_key, self._nonce_source)
+        with self._key_lock:
+            current_epoch, _, current_crypto = self._key_state
+            if epoch <= current_epoch:
+                return False
+            if self._previous_keys is not None and current_crypto:
+                self._previous_keys[current_epoch] = current_crypto
+            self._key_state = (epoch, topic_key, symmetric_crypto)
+        return True
+
+    def _apply_rotation(self, message, ignore_untrusted):
+        """
+        Verify a key rotation and, if it is addressed to us and newer than
+        our key, switch to the new key.
+
+        Rotations are always verified, even when decoding naively, as they
+        replace the topic key.
+
+        :param Message message: The rotation message.
+        :returns: `None` or an exception instance.
+        """
+        sender_id = message.sender_id
+        if sender_id not in self._participants:
+            if ignore_untrusted:
+                self._drop("untrusted_dropped", message)
+                return
+            return UntrustedKeyError(
+                "Verification key for participant not found."
+            )
+        self._get_verifier(sender_id).verify(message.signed_payload)
+        if message.epoch <= self.epoch:
+            # We have already moved past this rotation.
+            return
+
+        encrypted_topic_key = _find_entry(
+            message, _ROTATION_HEADER_LENGTH, self._id
+        )
+        if encrypted_topic_key is None:
+            # The rotation doesn't include us, so we can't follow it.
+            # Messages with the new epoch will fail to decode with a
+            # MissingTopicKeyError.
+            return
+        crypto = AsymmetricCrypto(
+            box_cache_size=1, private_key=self._signer.encryption_private_key
+        )
+        topic_key = crypto.decrypt(encrypted_topic_key, message.encryption_key)
+        if not self._set_key(topic_key, message.epoch):
+            # Another thread applied this rotation, or a newer one, first.
+            return
+        if self._metrics is not None:
+            self._metrics.increment("key_rotations_total")
+
     #########
     # Encoding/decoding methods
     #
@@ -362,14 +1558,231 @@ class Topic(object):
         :returns: The encrypted ciphertext to broadcast.
         :rtype: bytes
         """
+        epoch, _, symmetric_crypto = self._key_state
+        if symmetric_crypto is None:
+            raise MissingTopicKeyError(
+                "Cannot encode data without a topic key."
+            )
+
+        metrics = self._metrics
+        if metrics is not None:
+            start = clock()
+        codec = None
+        if self._compressor is not None:
+            codec, message = self._compressor.compress(message)
+        encoded = self._seal(
+            epoch, symmetric_crypto, symmetric_crypto.encrypt(message), codec
+        )
+        if metrics is not None:
+            metrics.observe("encode_seconds", clock() - start)
+            metrics.increment("encoded_total")
+        return encoded
+
+    def encode_many(self, messages, batch_sign=False):
+        """
+        Encode a batch of messages for transmission.
+
+        This is equivalent to calling `encode` on every message, but is
+        considerably cheaper for many small messages, as the per-message
+        overhead is amortized over the whole batch.
+
+        :param messages: An iterable of plaintexts to encode.
+        :param bool batch_sign: If `True`, sign the whole batch with a single
+            signature over the root of a Merkle tree of the messages, instead
+            of signing each message. Every message carries its inclusion
+            proof, which adds 32 bytes per doubling of the batch size, and can
+            still be verified and decoded on its own. Receivers verify the
+            signature once per batch, so this makes both encoding and
+            decoding much cheaper for large batches of small messages.
+
+        :returns: The encrypted ciphertexts to broadcast, in order.
+        :rtype: list
+        """
+        epoch, _, symmetric_crypto = self._key_state
+        if symmetric_crypto is None:
+            raise MissingTopicKeyError(
+                "Cannot encode data without a topic key."
+            )
+
+        metrics = self._metrics
+        if metrics is not None:
+            start = clock()
+        if self._compressor is None:
+            codecs = None
+        else:
+            compressed = [
+                self._compressor.compress(message) for message in messages
+            ]
+            codecs = [codec for codec, _ in compressed]
+            messages = [message for _, message in compressed]
+        ciphertexts = symmetric_crypto.encrypt_many(messages)
+        if codecs is None:
+            codecs = [None] * len(ciphertexts)
+        if batch_sign:
+            encoded = []
+            for start in range(0, len(ciphertexts), _MAX_BATCH_SIZE):
+                end = start + _MAX_BATCH_SIZE
+                encoded.extend(self._seal_batch(
+                    epoch, ciphertexts[start:end], codecs[start:end]
+                ))
+        else:
+            seal = self._seal
+            encoded = [
+                seal(epoch, symmetric_crypto, ciphertext, codec)
+                for ciphertext, codec in zip(ciphertexts, codecs)
+            ]
+        if metrics is not None:
+            metrics.observe("encode_many_seconds", clock() - start)
+            metrics.increment("encoded_total", len(encoded))
+        return encoded
+
+    def _seal(self, epoch, symmetric_crypto, ciphertext, codec=None):
+        """
+        Sign a ciphertext and wrap it in a message.
+
+        :param int epoch: The epoch of the key the plaintext was encrypted
+            with.
+        :param SymmetricCrypto symmetric_crypto: The crypto of that key.
+        :param bytes ciphertext: The encrypted plaintext.
+        :param int codec: The codec byte, if the plaintext was compressed.
+        :rtype: bytes
+        """
+        if self._mac_authentication:
+            payload = self._id + self._fields(epoch, codec) + ciphertext
+            return b"".join((
+                MESSAGE_AUTHENTICATED,
+                symmetric_crypto.mac(self._id, payload),
+                payload,
+            ))
+        if self._replay is None and not epoch and codec is None:
+            return MESSAGE_SIMPLE + self._signer.sign(self._id + ciphertext)
+        return MESSAGE_EXTENDED + self._signer.sign(
+            self._id + self._fields(epoch, codec) + ciphertext
+        )
+
+    def _seal_batch(self, epoch, ciphertexts, codecs):
+        """
+        Sign a batch of ciphertexts with one signature, and wrap each in a
+        message with its inclusion proof.
+
+        :param int epoch: The epoch of the key the plaintexts were encrypted
+            with.
+        :param list ciphertexts: The encrypted plaintexts.
+        :param list codecs: The codec byte of each plaintext, or `None` if it
+            wasn't compressed.
+        :rtype: list
+        """
+        headers = [self._id + self._fields(epoch, codec) for codec in codecs]
+        root, proofs = build_tree([
+            leaf_hash(header, ciphertext)
+            for header, ciphertext in zip(headers, ciphertexts)
+        ])
+        signature = self._signer.sign(_ROOT_DOMAIN + root)[:64]
+        size = len(ciphertexts)
+        return [
+            b"".join([
+                MESSAGE_BATCH_SIGNED, signature, header,
+                _PROOF_HEADER.pack(index, size, len(proof)),
+            ] + proof + [ciphertext])
+            for index, (header, proof, ciphertext) in enumerate(
+                zip(headers, proofs, ciphertexts)
+            )
+        ]
+
+    def _fields(self, epoch, codec=None):
+        """
+        Return the flags and optional fields of an extended message.
+
+        :param int epoch: The epoch of the key the message is encrypted with.
+        :param int codec: The codec byte, if the plaintext was compressed.
+        :rtype: bytes
+        """
+        flags = 0
+        fields = b""
+        if self._replay is not None:
+            flags |= FLAG_SEQUENCE
+            fields += _SEQUENCE.pack(next(self._sequence))
+        if epoch:
+            flags |= FLAG_EPOCH
+            fields += _EPOCH.pack(epoch)
+        if codec is not None:
+            flags |= FLAG_COMPRESSED
+            fields += _FLAGS.pack(codec)
+        return _FLAGS.pack(flags) + fields
+
+    def encode_stream(self, data, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Encode a large payload as a stream of chunks.
+
+        Every chunk is encrypted and signed separately, and carries the ID of
+        the stream, its position in it and whether it is the last one, so
+        the receiver can detect reordered, missing or truncated chunks. Only
+        one chunk is held in memory at a time. Decode the chunks with
+        `decode_stream` or a `StreamDecoder`.
+
+        :param data: Either a file-like object opened in binary mode, or an
+            iterable of bytestrings.
+        :param int chunk_size: The maximum size of the plaintext in each
+            chunk.
+        :returns: An iterator over the messages to broadcast, in order.
+        :raises MissingTopicKeyError: if the topic key is unknown.
+        """
         if not self.topic_key:
             raise MissingTopicKeyError(
                 "Cannot encode data without a topic key."
             )
+        if chunk_size < 1:
+            raise ValueError("The chunk size must be at least 1.")
+
+        if hasattr(data, "read"):
+            chunks = iter(lambda: data.read(chunk_size), b"")
+        else:
+            chunks = _rechunk(data, chunk_size)
+        return self._encode_chunks(chunks)
+
+    def _encode_chunks(self, chunks):
+        stream_id = nacl.utils.random(_STREAM_ID_LENGTH)
+        index = 0
+        pending = b""
+        for position, chunk in enumerate(chunks):
+            if position:
+                yield self._encode_chunk(stream_id, index, False, pending)
+                index += 1
+            pending = chunk
+        yield self._encode_chunk(stream_id, index, True, pending)
+
+    def _encode_chunk(self, stream_id, index, last, chunk):
+        epoch, _, symmetric_crypto = self._key_state
+        flags = _CHUNK_FINAL if last else 0
+        fields = b""
+        if self._replay is not None:
+            # Receivers with replay protection drop unsequenced chunks.
+            flags |= _CHUNK_SEQUENCE
+            fields += _SEQUENCE.pack(next(self._sequence))
+        if epoch:
+            flags |= _CHUNK_EPOCH
+            fields += _EPOCH.pack(epoch)
+        header = _CHUNK_HEADER.pack(index, flags) + fields
+        ciphertext = symmetric_crypto.encrypt(chunk)
+        return MESSAGE_CHUNK + self._signer.sign(
+            self._id + stream_id + header + ciphertext
+        )
 
-        ciphertext = self.id + self._symmetric_crypto.encrypt(message)
-        signed = self._signer.sign(ciphertext)
-        return MESSAGE_SIMPLE + signed
+    def decode_stream(self, messages, naive=False):
+        """
+        Decode a stream of chunks produced by `encode_stream`.
+
+        :param messages: An iterable of the raw chunk messages, in order.
+        :param bool naive: If `True`, signature verification **IS NOT
+            PERFORMED**. Use at your own risk.
+        :returns: An iterator over the decrypted chunks of the payload.
+        :raises MalformedMessageError: if chunks are missing, out of order,
+            or the stream ends before its last chunk.
+        """
+        decoder = StreamDecoder(self, naive=naive)
+        for message in messages:
+            yield decoder.feed(message)
+        decoder.close()
 
     def decode(self, message, naive=False, ignore_untrusted=False):
         """
@@ -378,7 +1791,8 @@ class Topic(object):
         If `naive` is True, signature verification will not be performed. Use
         at your own risk.
 
-        :param bytes message: The plaintext to encode.
+        :param bytes message: The raw message from the channel. This can
+            also be a `MessageView`, to avoid copying large messages.
         :param bool naive: If `True`, signature verification **IS NOT
             PERFORMED**. Use at your own risk.
         :param bool ignore_untrusted: If `True`, messages from unknown
@@ -387,36 +1801,395 @@ class Topic(object):
             still raise an exception.
         :returns: The decrypted and (optionally) verified plaintext.
         :rtype: bytes
+        :raises MalformedMessageError: if the message is truncated or of an
+            unknown type.
         """
-        message = Message(message)
-
-        # Ignore our own messages.
-        if message.sender_id == self.id:
-            print("I sent this.")
+        # Drop our own messages, and anything else we can reject cheaply.
+        dropped = self._prefilter(message, naive, ignore_untrusted)
+        if dropped is not None:
+            self._drop(dropped, message)
             return
 
-        if message.type == MESSAGE_INTRO and self.topic_key:
+        metrics = self._metrics
+        if metrics is not None:
+            start = clock()
+        result = self._decode(_as_message(message), naive, ignore_untrusted)
+        if metrics is not None:
+            metrics.observe("decode_seconds", clock() - start)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def decode_many(self, messages, naive=False, ignore_untrusted=False):
+        """
+        Decode a batch of messages.
+
+        This is equivalent to calling `decode` on every message in turn, except
+        that a bad message does not abort the batch. Instead of raising, the
+        exception `decode` would have raised is returned in that message's
+        position, so callers can deal with introductions, replies and invalid
+        messages after the whole batch has been processed.
+
+        :param messages: An iterable of raw messages from the channel.
+        :param bool naive: If `True`, signature verification **IS NOT
+            PERFORMED**. Use at your own risk.
+        :param bool ignore_untrusted: If `True`, messages from unknown
+            participants will be silently ignored.
+        :returns: A list with one entry per message, in order. Each entry is
+            the decrypted plaintext, `None` if the message was dropped, or the
+            exception instance that describes why decoding failed.
+        :rtype: list
+        """
+        metrics = self._metrics
+        if metrics is not None:
+            start = clock()
+        decode = self._decode
+        results = []
+        for message in messages:
+            dropped = self._prefilter(message, naive, ignore_untrusted)
+            if dropped is not None:
+                self._drop(dropped, message)
+                results.append(None)
+                continue
+            try:
+                result = decode(
+                    _as_message(message), naive, ignore_untrusted
+                )
+            except (
+                BadSignatureError, MalformedMessageError,
+                nacl.exceptions.CryptoError
+            ) as e:
+                result = e
+            results.append(result)
+        if metrics is not None:
+            metrics.observe("decode_many_seconds", clock() - start)
+        return results
+
+    def _decode(self, message, naive, ignore_untrusted):
+        """
+        Decode a single parsed message.
+
+        Errors that depend only on the type of the message are returned rather
+        than raised, so that `decode_many` does not have to pay for exception
+        handling on every introduction or reply. Cryptographic failures are
+        still raised.
+
+        :param Message message: The message to decode.
+        :returns: The plaintext, `None` or an exception instance.
+        """
+        message_type = message.type
+        if message_type == MESSAGE_UNKNOWN:
+            return MalformedMessageError("The message type is unknown.")
+        if message_type == MESSAGE_INTRO and self.topic_key:
             # This is an introduction.
-            raise IntroductionError("The received message is an introduction.")
-        elif message.type == MESSAGE_REPLY and not self.topic_key:
+            if self._metrics is not None:
+                self._metrics.increment("intros_total")
+            return IntroductionError("The received message is an introduction.")
+        elif (message_type == MESSAGE_REPLY or
+                message_type == MESSAGE_BATCH_REPLY) and not self.topic_key:
             # This is a reply to an introduction.
-            raise IntroductionReplyError(
+            if self._metrics is not None:
+                self._metrics.increment("replies_total")
+            return IntroductionReplyError(
                 "The received message is an introduction reply."
             )
-        elif message.type == MESSAGE_SIMPLE:
-            if not naive:
-                # Verify the signature.
-                if message.sender_id not in self._participants:
-                    if ignore_untrusted:
-                        # We want to just drop messages from unknown
-                        # participants on the floor.
-                        return
-                    else:
-                        raise UntrustedKeyError(
-                            "Verification key for participant not found."
-                        )
-                sender_key = self._participants[message.sender_id]
-                verifier = Verifier(sender_key)
-                verifier.verify(message.signed_payload)
-            plaintext = self._symmetric_crypto.decrypt(message.ciphertext)
+        elif (message_type == MESSAGE_SIMPLE or
+                message_type == MESSAGE_EXTENDED or
+                message_type == MESSAGE_BATCH_SIGNED or
+                message_type == MESSAGE_AUTHENTICATED):
+            return self._open(message, naive, ignore_untrusted)
+        elif message_type == MESSAGE_CHUNK:
+            return StreamChunkError(
+                "The received message is a chunk of a stream."
+            )
+        elif message_type == MESSAGE_ROTATION:
+            return self._apply_rotation(message, ignore_untrusted)
+
+    def _open(self, message, naive, ignore_untrusted):
+        """
+        Verify and decrypt a signed message.
+
+        :param Message message: The message to open.
+        :returns: The plaintext, `None` or an exception instance.
+        """
+        header = message._header
+        # The message has been validated, and the sender ID of every signed
+        # type is in the same place.
+        sender_id = _as_bytes(message[65:81])
+        sequence = header.sequence
+        replay = self._replay
+        if replay is not None and not self._check_replay(
+            message, sender_id, sequence
+        ):
+            return
+
+        symmetric_crypto = self._get_crypto(header.epoch)
+        if not naive:
+            # Verify the signature.
+            if sender_id not in self._participants:
+                if ignore_untrusted:
+                    # We want to just drop messages from unknown
+                    # participants on the floor.
+                    self._drop("untrusted_dropped", message)
+                    return
+                else:
+                    return UntrustedKeyError(
+                        "Verification key for participant not found."
+                    )
+            error = self._authenticate(message, sender_id, symmetric_crypto)
+            if error is not None:
+                return error
+        if isinstance(symmetric_crypto, Exception):
+            return symmetric_crypto
+        plaintext = self._decrypt(message, symmetric_crypto)
+        # Only record the message once it has been decrypted, so that
+        # messages that arrive before the key they were sent with can still
+        # be decoded when they are delivered again.
+        if replay is not None:
+            replay.update(sender_id, sequence)
+        if self._recent is not None:
+            self._recent[_duplicate_key(message)] = True
+        return plaintext
+
+    def _check_replay(self, message, sender_id, sequence):
+        """
+        Check a message against the replay window, dropping it if it could be
+        a replay.
+
+        :param Message message: The message to check.
+        :param bytes sender_id: The ID of the sender.
+        :param int sequence: The sequence number of the message, or `None` if
+            it doesn't have one.
+        :returns: Whether the message should be opened.
+        :rtype: bool
+        """
+        if sequence is None:
+            # Unsequenced messages could be replayed at will.
+            self._drop("unsequenced_dropped", message)
+            return False
+        # Drop duplicates before paying for verification and decryption.
+        if not self._replay.check(sender_id, sequence):
+            self._drop("replay_dropped", message)
+            return False
+        return True
+
+    def _authenticate(self, message, sender_id, symmetric_crypto):
+        """
+        Verify the signature or MAC of a message from a trusted participant.
+
+        :param Message message: The message to verify.
+        :param bytes sender_id: The ID of the sender.
+        :param symmetric_crypto: The result of `_get_crypto` for the message.
+        :returns: `None` if the message is authentic, or an exception instance
+            if it can't be authenticated.
+        :raises BadSignatureError: if the signature or MAC is invalid.
+        """
+        if message.type == MESSAGE_AUTHENTICATED:
+            if not self._mac_authentication:
+                # Anyone who knows the topic key can forge these, so they are
+                # only trusted if we opted in.
+                return UntrustedKeyError(
+                    "Authenticated messages are not accepted on this topic."
+                )
+            if isinstance(symmetric_crypto, Exception):
+                # We can't authenticate the message without its key.
+                return symmetric_crypto
+            verify = symmetric_crypto.verify_mac
+            arguments = (sender_id, message[65:], _as_bytes(message[1:65]))
+        else:
+            verify = self._verify
+            arguments = (message, sender_id)
+        metrics = self._metrics
+        if metrics is None:
+            verify(*arguments)
+            return
+        start = clock()
+        try:
+            verify(*arguments)
+        except BadSignatureError:
+            metrics.increment("signature_failures_total")
+            raise
+        metrics.observe("verify_seconds", clock() - start)
+
+    def _decrypt(self, message, symmetric_crypto):
+        """
+        Decrypt and decompress the payload of a message.
+
+        :param Message message: The message to decrypt.
+        :param SymmetricCrypto symmetric_crypto: The crypto for its epoch.
+        :returns: The plaintext.
+        :rtype: bytes
+        """
+        metrics = self._metrics
+        if metrics is None:
+            plaintext = symmetric_crypto.decrypt(message.ciphertext)
+        else:
+            start = clock()
+            plaintext = symmetric_crypto.decrypt(message.ciphertext)
+            metrics.observe("decrypt_seconds", clock() - start)
+            metrics.increment("decoded_total")
+        codec = message._header.codec
+        if codec is None:
             return plaintext
+        if self._compressor is None:
+            return decompress(codec, plaintext)
+        return self._compressor.decompress(codec, plaintext)
+
+    def _get_crypto(self, epoch):
+        """
+        Return the symmetric crypto for the topic key of an epoch.
+
+        :param int epoch: The epoch of the message, or `None` if it doesn't
+            have one.
+        :returns: The SymmetricCrypto, or a MissingTopicKeyError instance if
+            we don't have the key.
+        """
+        # Messages without an epoch were sent before the key was ever rotated.
+        epoch = epoch or 0
+        current_epoch, _, current_crypto = self._key_state
+        if epoch == current_epoch:
+            if current_crypto is None:
+                return MissingTopicKeyError(
+                    "Cannot decode data without a topic key."
+                )
+            return current_crypto
+        # The message was sent with a previous key, or with a new one we
+        # haven't received yet.
+        symmetric_crypto = None
+        if self._previous_keys is not None:
+            symmetric_crypto = self._previous_keys.get(epoch)
+        if symmetric_crypto is None:
+            return MissingTopicKeyError(
+                "The topic key of epoch %s is unknown." % epoch
+            )
+        return symmetric_crypto
+
+    def _verify(self, message, sender_id):
+        """
+        Verify the signature of a message from a trusted participant.
+
+        :param Message message: The message to verify.
+        :param bytes sender_id: The ID of the sender.
+        :raises BadSignatureError: if the signature is invalid.
+        """
+        verifier = self._get_verifier(sender_id)
+        if message.type != MESSAGE_BATCH_SIGNED:
+            verifier.verify(message.signed_payload)
+            return
+
+        header = message._header
+        proof_start = header.proof_offset + _PROOF_HEADER.size
+        index, size, proof_length = _PROOF_HEADER.unpack(
+            _as_bytes(message[header.proof_offset:proof_start])
+        )
+        root = root_from_proof(
+            leaf_hash(
+                message[65:header.proof_offset],
+                message[header.payload_offset:],
+            ),
+            index,
+            size,
+            [
+                _as_bytes(message[offset:offset + HASH_LENGTH])
+                for offset in range(
+                    proof_start, header.payload_offset, HASH_LENGTH
+                )
+            ],
+        )
+        if root is None:
+            raise BadSignatureError("The inclusion proof is invalid.")
+        # Roots are signed by their sender, so they are only trusted for that
+        # sender, and only along with the signature that was checked for them.
+        signature = _as_bytes(message[1:65])
+        key = sender_id + root + signature
+        if key in self._roots:
+            return
+        verifier.verify(signature + _ROOT_DOMAIN + root)
+        self._roots[key] = True
+
+
+class StreamDecoder(object):
+    """
+    An incremental decoder for a stream produced by `Topic.encode_stream`.
+
+    Feed it the chunks of a single stream as they arrive, and it will return
+    the plaintext of each one, after making sure it belongs to the same stream
+    and comes right after the previous one.
+    """
+
+    def __init__(self, topic, naive=False):
+        """
+        :param Topic topic: The topic the stream was sent on.
+        :param bool naive: If `True`, signature verification **IS NOT
+            PERFORMED**. Use at your own risk.
+        """
+        self._topic = topic
+        self._naive = naive
+        self._sender_id = None
+        self._stream_id = None
+        self._next_index = 0
+        self.finished = False
+
+    def feed(self, message):
+        """
+        Decode the next chunk of the stream.
+
+        :param bytes message: The raw chunk message from the channel.
+        :returns: The decrypted plaintext of the chunk.
+        :rtype: bytes
+        :raises MalformedMessageError: if the message is not the next chunk of
+            this stream, or was dropped by replay protection.
+        :raises UntrustedKeyError: if the sender is not trusted.
+        """
+        message = _as_message(message)
+        if message.type != MESSAGE_CHUNK:
+            raise MalformedMessageError("The message is not a stream chunk.")
+        if self.finished:
+            raise MalformedMessageError("The stream has already ended.")
+
+        if self._stream_id is not None and (
+                message.sender_id != self._sender_id or
+                message.stream_id != self._stream_id):
+            raise MalformedMessageError("The chunk belongs to another stream.")
+
+        if message.chunk_index != self._next_index:
+            raise MalformedMessageError("The chunk is out of order.")
+
+        result = self._topic._open(message, self._naive, False)
+        if isinstance(result, Exception):
+            raise result
+        if result is None:
+            raise MalformedMessageError(
+                "The chunk was dropped by replay protection."
+            )
+
+        # Only remember the stream once a chunk of it has been verified.
+        self._sender_id = message.sender_id
+        self._stream_id = _as_bytes(message.stream_id)
+        self._next_index += 1
+        self.finished = message.last_chunk
+        return result
+
+    def close(self):
+        """
+        Signal that no more chunks will arrive.
+
+        :raises MalformedMessageError: if the last chunk was never received.
+        """
+        if not self.finished:
+            raise MalformedMessageError("The stream was truncated.")
+
+
+def _rechunk(iterable, chunk_size):
+    """
+    Regroup an iterable of bytestrings into chunks of `chunk_size` bytes. The
+    last chunk may be shorter.
+    """
+    buffer = bytearray()
+    for data in iterable:
+        buffer += data
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
@@ -0,0 +1,64 @@
+import asyncio
+
+from stringphone import Topic, generate_topic_key
+from stringphone.aio import AsyncTopic
+from stringphone.exceptions import BadSignatureError
+
+
+async def _iterate(messages):
+    for message in messages:
+        yield message
+
+
+def test_async_round_trip():
+    topic_key = generate_topic_key()
+    master = AsyncTopic(Topic(topic_key=topic_key))
+    slave = AsyncTopic(Topic(topic_key=topic_key))
+    master.topic.add_participant(slave.topic.public_key)
+
+    async def main():
+        message = await slave.encode(b"Hello!")
+        return await master.decode(message)
+
+    assert asyncio.run(main()) == b"Hello!"
+
+
+def test_async_dispatch():
+    master = AsyncTopic(Topic(topic_key=generate_topic_key()))
+    slave = AsyncTopic(Topic())
+    received = []
+
+    async def on_intro(message):
+        master.topic.add_participant(message.sender_key)
+        reply = await master.construct_reply(message)
+        await slave.run(_iterate([reply]), received.append)
+
+    async def main():
+        intro = slave.topic.construct_intro()
+        await master.run(_iterate([intro]), received.append, on_intro=on_intro)
+        slave.topic.add_participant(master.topic.public_key)
+        messages = [await master.encode(b"One"), await master.encode(b"Two")]
+        await slave.run(_iterate(messages), received.append)
+
+    asyncio.run(main())
+    assert slave.topic.topic_key == master.topic.topic_key
+    assert received == [b"One", b"Two"]
+
+
+def test_async_reply_errors():
+    master = Topic(topic_key=generate_topic_key())
+    slave = AsyncTopic(Topic())
+    reply = master.construct_reply_batch([slave.topic.construct_intro()])
+    forged = reply[:1] + bytes(bytearray([reply[1] ^ 1])) + reply[2:]
+    errors = []
+
+    async def main():
+        await slave.run(
+            _iterate([forged, reply]), None,
+            on_error=lambda raw, error: errors.append((raw, error))
+        )
+
+    asyncio.run(main())
+    assert [raw for raw, _ in errors] == [forged]
+    assert isinstance(errors[0][1], BadSignatureError)
+    assert slave.topic.topic_key == master.topic_key
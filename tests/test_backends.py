@@ -0,0 +1,92 @@
+import nacl.exceptions
+import pytest
+from hypothesis import given
+from hypothesis.strategies import binary, sampled_from
+
+from stringphone import Topic, generate_topic_key
+from stringphone import backends
+from stringphone.backends import Backend, available_backends, select_backend
+from stringphone.crypto import (
+    Signer, SymmetricCrypto, Verifier, generate_signing_key_seed
+)
+from stringphone.exceptions import BadSignatureError
+
+BACKENDS = available_backends()
+
+
+@given(binary(), sampled_from(BACKENDS), sampled_from(BACKENDS))
+def test_backends_interoperate(bytestring, backend, other):
+    seed = generate_signing_key_seed()
+    key = generate_topic_key()
+    signer = Signer(seed, backend=backend)
+    signed = signer.sign(bytestring)
+    assert signed == Signer(seed, backend=other).sign(bytestring)
+    assert Verifier(
+        signer.public_key, backend=other
+    ).verify(signed) == bytestring
+
+    ciphertext = SymmetricCrypto(key, backend=backend).encrypt(bytestring)
+    assert SymmetricCrypto(
+        key, backend=other
+    ).decrypt(ciphertext) == bytestring
+
+
+@pytest.mark.parametrize("backend", BACKENDS, ids=lambda b: b.name)
+def test_backend_rejects_invalid_input(backend):
+    signer = Signer(generate_signing_key_seed(), backend=backend)
+    verifier = Verifier(signer.public_key, backend=backend)
+    signed = signer.sign(b"hello")
+    with pytest.raises(BadSignatureError):
+        verifier.verify(signed[:-1] + b"O")
+    with pytest.raises(BadSignatureError):
+        verifier.verify(signed[:10])
+    with pytest.raises(nacl.exceptions.ValueError):
+        Verifier(signer.public_key[:-1], backend=backend)
+
+    crypto = SymmetricCrypto(generate_topic_key(), backend=backend)
+    ciphertext = crypto.encrypt(b"hello")
+    with pytest.raises(nacl.exceptions.CryptoError):
+        crypto.decrypt(ciphertext[:-1] + b"O")
+    with pytest.raises(nacl.exceptions.CryptoError):
+        crypto.decrypt(ciphertext[:30])
+
+
+def test_backend_selection():
+    class BrokenBackend(Backend):
+        name = "broken"
+
+        def sign(self, signing_key, message):
+            return b"\x00" * 64 + message
+
+    class UnavailableBackend(Backend):
+        name = "unavailable"
+
+        def sign(self, signing_key, message):
+            raise OSError("The library went away.")
+
+    class BuggyBackend(Backend):
+        name = "buggy"
+
+        def sign(self, signing_key, message):
+            raise RuntimeError("A bug.")
+
+    assert select_backend([BrokenBackend()]).name == "nacl"
+    assert select_backend([UnavailableBackend()]).name == "nacl"
+    # Bugs in a backend are not mistaken for it being unavailable.
+    with pytest.raises(RuntimeError):
+        select_backend([BuggyBackend()])
+    assert select_backend().name in [b.name for b in BACKENDS]
+
+    previous = backends.get_backend()
+    try:
+        backends.set_backend("nacl")
+        assert backends.get_backend().name == "nacl"
+        topic_key = generate_topic_key()
+        sender = Topic(topic_key=topic_key)
+        receiver = Topic(topic_key=topic_key)
+        receiver.add_participant(sender.public_key)
+        assert receiver.decode(sender.encode(b"hello")) == b"hello"
+        with pytest.raises(ValueError):
+            backends.set_backend("nonexistent")
+    finally:
+        backends.set_backend(previous)
@@ -0,0 +1,68 @@
+import pytest
+from hypothesis import given
+from hypothesis.strategies import binary, sampled_from
+
+from stringphone import Message, Topic, generate_topic_key
+from stringphone.compression import (
+    CODEC_LZMA, CODEC_ZLIB, Compressor, available_codecs, decompress
+)
+from stringphone.exceptions import MalformedMessageError
+
+TELEMETRY = b'{"sensor": "temperature", "value": 21.5, "unit": "celsius"}'
+
+
+@given(binary(), sampled_from(available_codecs()))
+def test_compression_roundtrip(bytestring, codec):
+    compressor = Compressor(codec, threshold=0)
+    codec, compressed = compressor.compress(bytestring * 4)
+    if codec is None:
+        assert compressed == bytestring * 4
+    else:
+        assert len(compressed) < len(bytestring * 4)
+        assert compressor.decompress(codec, compressed) == bytestring * 4
+
+
+def test_threshold():
+    compressor = Compressor(threshold=len(TELEMETRY) * 2 + 1)
+    assert compressor.compress(TELEMETRY * 2) == (None, TELEMETRY * 2)
+    assert compressor.compress(TELEMETRY * 3)[0] == CODEC_ZLIB
+
+
+def test_dictionary():
+    compressor = Compressor(threshold=0, dictionary=TELEMETRY * 4)
+    codec, compressed = compressor.compress(TELEMETRY)
+    assert len(compressed) < len(Compressor(threshold=0).compress(
+        TELEMETRY
+    )[1])
+    assert compressor.decompress(codec, compressed) == TELEMETRY
+    with pytest.raises(MalformedMessageError):
+        decompress(codec, compressed)
+    with pytest.raises(ValueError):
+        Compressor(CODEC_LZMA, dictionary=TELEMETRY)
+
+
+def test_decompression_limits():
+    codec, compressed = Compressor(threshold=0).compress(b"\0" * 100000)
+    with pytest.raises(MalformedMessageError):
+        decompress(codec, compressed, max_size=1000)
+    with pytest.raises(MalformedMessageError):
+        decompress(codec, compressed[:-2])
+    with pytest.raises(MalformedMessageError):
+        decompress(0x7f, compressed)
+
+
+@given(binary())
+def test_compressed_messages(bytestring):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, compression=Compressor(threshold=0))
+    slave = Topic(topic_key=topic_key)
+
+    payload = TELEMETRY * 3 + bytestring
+    message = master.encode(payload)
+    assert Message(message).type == b"x"
+    assert len(message) < len(slave.encode(payload))
+    assert slave.decode(message, naive=True) == payload
+    assert slave.decode_many(
+        master.encode_many([payload, b"", payload], batch_sign=True),
+        naive=True
+    ) == [payload, b"", payload]
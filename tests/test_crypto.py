@@ -1,9 +1,16 @@
 from hypothesis import given
-from hypothesis.strategies import binary
+from hypothesis.strategies import binary, lists
+
+import os
+
+import nacl.encoding
+import nacl.hash
+import pytest
 
 from stringphone.crypto import (
     Signer, AsymmetricCrypto, SymmetricCrypto, generate_signing_key_seed,
-    generate_topic_key, Verifier
+    generate_topic_key, Verifier, NonceSource, BufferedNonceSource,
+    CounterNonceSource, NONCE_SIZE
 )
 
 
@@ -27,3 +34,73 @@ def test_verification_inverts_signing(bytestring):
     s = Signer(generate_signing_key_seed())
     v = Verifier(s.public_key)
     assert v.verify(s.sign(bytestring)) == bytestring
+
+
+@given(binary())
+def test_mac_matches_libsodium(bytestring):
+    # Interpreters without hashlib.blake2b use libsodium's, so both must
+    # produce the same codes.
+    topic_key = generate_topic_key()
+    sender_id = os.urandom(16)
+    key = nacl.hash.blake2b(
+        sender_id, digest_size=32, key=topic_key, person=b"stringphone-mac",
+        encoder=nacl.encoding.RawEncoder,
+    )
+    mac = SymmetricCrypto(topic_key).mac(sender_id, bytestring)
+    assert mac == nacl.hash.blake2b(
+        bytestring, digest_size=64, key=key, encoder=nacl.encoding.RawEncoder
+    )
+
+
+@given(lists(binary(), max_size=10))
+def test_symmetric_batch_encryption(bytestrings):
+    c = SymmetricCrypto(generate_topic_key())
+    assert [c.decrypt(x) for x in c.encrypt_many(bytestrings)] == bytestrings
+
+
+@given(binary())
+def test_asymmetric_box_cache(bytestring):
+    a1 = AsymmetricCrypto(box_cache_size=1)
+    a2 = AsymmetricCrypto()
+    a3 = AsymmetricCrypto()
+    for _ in range(2):
+        for a in (a2, a3):
+            assert a.decrypt(
+                a1.encrypt(bytestring, a.public_key), a1.public_key
+            ) == bytestring
+    a1.clear_box_cache()
+    assert a2.decrypt(
+        a1.encrypt(bytestring, a2.public_key), a1.public_key
+    ) == bytestring
+
+
+@given(lists(binary(), max_size=10))
+def test_nonce_sources(bytestrings):
+    for source in (
+        NonceSource(), BufferedNonceSource(batch_size=4), CounterNonceSource()
+    ):
+        c = SymmetricCrypto(generate_topic_key(), source)
+        ciphertexts = [c.encrypt(x) for x in bytestrings]
+        ciphertexts += c.encrypt_many(bytestrings)
+        assert [c.decrypt(x) for x in ciphertexts] == bytestrings * 2
+        nonces = [x[:NONCE_SIZE] for x in ciphertexts]
+        assert len(set(nonces)) == len(nonces)
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "register_at_fork"), reason="Requires os.register_at_fork."
+)
+def test_nonce_sources_after_fork():
+    for source in (BufferedNonceSource(), CounterNonceSource()):
+        source.nonce()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(write_fd, source.nonce())
+            os._exit(0)
+        os.close(write_fd)
+        child_nonce = os.read(read_fd, NONCE_SIZE)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        assert len(child_nonce) == NONCE_SIZE
+        assert child_nonce != source.nonce()
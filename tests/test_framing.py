@@ -0,0 +1,32 @@
+import pytest
+from hypothesis import given
+from hypothesis.strategies import binary, integers, lists, sampled_from
+
+from stringphone.exceptions import MalformedMessageError
+from stringphone.framing import Deframer, decode_frame, encode_frame
+
+
+@given(binary(max_size=1000), sampled_from([None, "base64", "base85"]))
+def test_decoding_inverts_framing(bytestring, encoding):
+    frame = encode_frame(bytestring, encoding=encoding)
+    assert decode_frame(frame, encoding=encoding) == bytestring
+
+
+@given(lists(binary(max_size=300)), integers(min_value=1, max_value=50))
+def test_deframing_stream(bytestrings, read_size):
+    stream = b"".join(encode_frame(b) for b in bytestrings)
+    deframer = Deframer()
+    messages = []
+    for i in range(0, len(stream), read_size):
+        messages.extend(deframer.feed(stream[i:i + read_size]))
+    assert messages == bytestrings
+    assert deframer.pending == 0
+
+
+def test_malformed_frames():
+    with pytest.raises(MalformedMessageError):
+        decode_frame(encode_frame(b"Hello")[:-1])
+    with pytest.raises(MalformedMessageError):
+        decode_frame(b"\x02\x00")
+    with pytest.raises(MalformedMessageError):
+        Deframer(max_frame_size=4).feed(encode_frame(b"Hello"))
@@ -0,0 +1,68 @@
+import pytest
+from hypothesis import given
+from hypothesis.strategies import binary
+
+from stringphone import Topic, TopicManager, generate_topic_key
+from stringphone.exceptions import UntrustedKeyError
+
+
+@given(binary())
+def test_routing(bytestring):
+    first_key = generate_topic_key()
+    second_key = generate_topic_key()
+    peer = Topic(topic_key=second_key)
+
+    manager = TopicManager(participants={})
+    first = manager.add_topic("first", topic_key=first_key)
+    second = manager.add_topic("second", topic_key=second_key)
+    assert first.id == second.id == manager.id
+
+    peer.add_participant(manager.public_key)
+    assert peer.decode(manager.encode("second", bytestring)) == bytestring
+
+    message = peer.encode(bytestring)
+    with pytest.raises(UntrustedKeyError):
+        manager.decode("second", message)
+    # Participants added to one topic are only trusted by that topic.
+    first.add_participant(peer.public_key)
+    assert peer.id not in manager.participants()
+    with pytest.raises(UntrustedKeyError):
+        manager.decode("second", message)
+    # Participants added to the shared roster are trusted by all topics.
+    manager.add_participant(peer.public_key)
+    assert peer.id in manager.participants()
+    assert manager.decode("second", message) == bytestring
+    # Participants removed from one topic are only distrusted by that topic.
+    second.remove_participant(peer.id)
+    with pytest.raises(UntrustedKeyError):
+        manager.decode("second", message)
+    assert peer.id in first.participants()
+    assert peer.id in manager.participants()
+
+
+def test_topic_rosters():
+    manager = TopicManager()
+    peer = Topic(topic_key=generate_topic_key())
+    shared = manager.add_topic("shared", topic_key=peer.topic_key)
+    manager.add_topic(
+        "private", topic_key=peer.topic_key, participants={}
+    )
+    shared.add_participant(peer.public_key)
+
+    message = peer.encode(b"hello")
+    assert manager.decode("shared", message) == b"hello"
+    with pytest.raises(UntrustedKeyError):
+        manager.decode("private", message)
+
+
+def test_topic_names():
+    manager = TopicManager()
+    manager.add_topic("topic")
+    with pytest.raises(ValueError):
+        manager.add_topic("topic")
+    assert "topic" in manager
+    assert list(manager) == ["topic"]
+    manager.remove_topic("topic")
+    assert len(manager) == 0
+    with pytest.raises(KeyError):
+        manager.decode("topic", b"")
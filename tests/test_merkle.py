@@ -0,0 +1,17 @@
+from hypothesis import given
+from hypothesis.strategies import binary, lists
+
+from stringphone.merkle import build_tree, leaf_hash, root_from_proof
+
+
+@given(lists(binary(), min_size=1, max_size=40, unique=True))
+def test_inclusion_proofs(data):
+    leaves = [leaf_hash(item) for item in data]
+    root, proofs = build_tree(leaves)
+    size = len(leaves)
+    for index, (leaf, proof) in enumerate(zip(leaves, proofs)):
+        assert root_from_proof(leaf, index, size, proof) == root
+        if size > 1:
+            assert root_from_proof(
+                leaf, (index + 1) % size, size, proof
+            ) != root
@@ -0,0 +1,46 @@
+import pytest
+
+from stringphone import Topic, generate_topic_key
+from stringphone.exceptions import BadSignatureError
+from stringphone.metrics import CallbackSink, MetricsRegistry
+
+
+def test_topic_metrics():
+    registry = MetricsRegistry()
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, metrics=registry)
+    slave = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+
+    master.decode(slave.encode(b"Hello"))
+    master.decode_many(slave.encode_many([b"One", b"Two"]))
+    master.decode(
+        Topic(topic_key=topic_key).encode(b"Hi"), ignore_untrusted=True
+    )
+    message = bytearray(slave.encode(b"Hello"))
+    message[1] ^= 1
+    with pytest.raises(BadSignatureError):
+        master.decode(bytes(message))
+
+    assert registry.counter("decoded_total") == 3
+    assert registry.counter("untrusted_dropped_total") == 1
+    assert registry.counter("signature_failures_total") == 1
+    assert registry.timing("verify_seconds")[0] == 3
+    assert registry.timing("decode_seconds")[0] == 1
+
+    text = registry.to_prometheus()
+    assert "stringphone_decoded_total 3\n" in text
+    assert 'stringphone_verify_seconds_bucket{le="+Inf"} 3\n' in text
+    assert "stringphone_verify_seconds_count 3\n" in text
+
+
+def test_callback_sink():
+    events = []
+    topic = Topic(
+        topic_key=generate_topic_key(),
+        metrics=CallbackSink(lambda *args: events.append(args[:2]))
+    )
+    topic.encode(b"Hello")
+    assert events == [
+        ("timing", "encode_seconds"), ("counter", "encoded_total")
+    ]
@@ -0,0 +1,85 @@
+from hypothesis import given
+from hypothesis.strategies import binary, lists
+
+from stringphone import Topic, generate_topic_key
+from stringphone.exceptions import MalformedMessageError, UntrustedKeyError
+from stringphone.parallel import DecodePool
+
+
+@given(lists(binary(), max_size=20))
+def test_parallel_decoding(bytestrings):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slaves = [Topic(topic_key=topic_key) for _ in range(3)]
+    for slave in slaves:
+        master.add_participant(slave.public_key)
+
+    messages = [
+        slaves[i % len(slaves)].encode(bytestring)
+        for i, bytestring in enumerate(bytestrings)
+    ]
+    with DecodePool(master, workers=2) as pool:
+        assert pool.decode_many(messages) == bytestrings
+
+        results = pool.decode_many(
+            [b"s", Topic(topic_key=topic_key).encode(b"Hi")]
+        )
+        assert isinstance(results[0], MalformedMessageError)
+        assert isinstance(results[1], UntrustedKeyError)
+
+
+class _ReversedExecutor(object):
+    """
+    An executor that runs the submitted calls in reverse order, once the
+    first result is needed, to simulate shards finishing out of order.
+    """
+
+    def __init__(self):
+        self._pending = []
+
+    def submit(self, function, *args):
+        future = _Future(self)
+        self._pending.append((future, function, args))
+        return future
+
+    def run(self):
+        while self._pending:
+            future, function, args = self._pending.pop()
+            future.value = function(*args)
+
+
+class _Future(object):
+    def __init__(self, executor):
+        self._executor = executor
+
+    def result(self):
+        self._executor.run()
+        return self.value
+
+
+def test_parallel_decoding_with_rotation():
+    topic_key = generate_topic_key()
+    receiver = Topic(topic_key=topic_key)
+    # Put the rotation in the first shard and the peer's messages in the
+    # second one, which the executor runs first.
+    rotator = Topic(topic_key=topic_key)
+    while hash(rotator.id) % 2 != 0:
+        rotator = Topic(topic_key=topic_key)
+    peer = Topic(topic_key=topic_key)
+    while hash(peer.id) % 2 != 1:
+        peer = Topic(topic_key=topic_key)
+    for topic in (rotator, receiver, peer):
+        for other in (rotator, receiver, peer):
+            if other is not topic:
+                topic.add_participant(other.public_key)
+
+    before = peer.encode(b"before rotation")
+    rotation = rotator.rotate_key()
+    assert peer.decode(rotation) is None
+    after = peer.encode(b"after rotation")
+
+    pool = DecodePool(receiver, workers=2, executor=_ReversedExecutor())
+    assert pool.decode_many([before, rotation, after]) == [
+        b"before rotation", None, b"after rotation"
+    ]
+    assert receiver.epoch == 1
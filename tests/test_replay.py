@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from stringphone import Topic, generate_topic_key
+from stringphone.exceptions import (
+    MalformedMessageError, MissingTopicKeyError
+)
+from stringphone.replay import ReplayWindow
+
+
+def test_replay_window():
+    window = ReplayWindow(window=8, max_senders=2)
+    for sequence in (10, 12, 11, 20):
+        assert window.check(b"a", sequence)
+        window.update(b"a", sequence)
+        assert not window.check(b"a", sequence)
+
+    # Too old for the window.
+    assert not window.check(b"a", 12)
+    assert window.check(b"a", 13)
+
+    # The least recently seen sender is evicted.
+    window.update(b"b", 1)
+    window.update(b"c", 1)
+    assert window.check(b"a", 20)
+    assert not window.check(b"b", 1)
+
+    window.forget(b"b")
+    assert window.check(b"b", 1)
+    assert not window.check(b"c", 1)
+
+
+def test_topic_replay_protection():
+    topic_key = generate_topic_key()
+    events = []
+    master = Topic(
+        topic_key=topic_key, replay_window=16,
+        event_callback=lambda event, message: events.append(event)
+    )
+    slave = Topic(topic_key=topic_key, replay_window=16)
+    master.add_participant(slave.public_key)
+
+    messages = slave.encode_many([b"One", b"Two"])
+    assert master.decode(messages[1]) == b"Two"
+    assert master.decode(messages[0]) == b"One"
+    assert master.decode(messages[0]) is None
+    assert master.decode(messages[1]) is None
+    assert events == ["replay_dropped", "replay_dropped"]
+
+    # Messages without sequence numbers can't be checked for replays.
+    unsequenced = Topic(topic_key=topic_key)
+    master.add_participant(unsequenced.public_key)
+    message = unsequenced.encode(b"Three")
+    assert master.decode(message) is None
+    assert master.decode(message) is None
+    assert events[2:] == ["unsequenced_dropped", "unsequenced_dropped"]
+
+    # Topics without replay protection can still read sequenced messages.
+    plain = Topic(topic_key=topic_key)
+    assert plain.decode(messages[0], naive=True) == b"One"
+    assert plain.decode(messages[0], naive=True) == b"One"
+
+
+def test_stream_replay_protection():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, replay_window=16)
+    slave = Topic(topic_key=topic_key, replay_window=16)
+    master.add_participant(slave.public_key)
+
+    payload = os.urandom(1000)
+    chunks = list(slave.encode_stream([payload], chunk_size=100))
+    assert b"".join(master.decode_stream(chunks)) == payload
+    with pytest.raises(MalformedMessageError):
+        list(master.decode_stream(chunks))
+
+    # Chunks without sequence numbers can't be checked for replays.
+    unsequenced = Topic(topic_key=topic_key)
+    master.add_participant(unsequenced.public_key)
+    with pytest.raises(MalformedMessageError):
+        list(master.decode_stream(unsequenced.encode_stream([payload])))
+
+
+def test_redelivery_after_rotation():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, replay_window=16)
+    slave = Topic(
+        topic_key=topic_key, replay_window=16, duplicate_cache_size=16
+    )
+    master.add_participant(slave.public_key)
+    slave.add_participant(master.public_key)
+
+    rotation = master.rotate_key()
+    early = master.encode(b"early")
+    # The message arrives before the rotation, so the key isn't known yet.
+    with pytest.raises(MissingTopicKeyError):
+        slave.decode(early, naive=True)
+    assert slave.decode(rotation) is None
+    assert slave.epoch == 1
+    # Once the rotation is in, the redelivered message can be read.
+    assert slave.decode(early) == b"early"
+    assert slave.decode(early) is None
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from stringphone import Topic, generate_topic_key
+from stringphone import store as store_module
+from stringphone.store import MappedParticipantStore
+
+
+def test_mapped_store(tmpdir):
+    path = os.path.join(str(tmpdir), "participants")
+    participants = dict(
+        (os.urandom(16), os.urandom(32)) for _ in range(50)
+    )
+
+    with MappedParticipantStore(path) as store:
+        store.update(participants)
+        removed = sorted(participants)[10]
+        del store[removed]
+        del participants[removed]
+        assert dict(store.items()) == participants
+
+    # The log is replayed on reopening.
+    with MappedParticipantStore(path) as store:
+        assert dict(store.items()) == participants
+        store.compact()
+        assert os.path.getsize(path + ".log") == 0
+        for participant_id, public_key in participants.items():
+            assert store[participant_id] == public_key
+        assert removed not in store
+        with pytest.raises(KeyError):
+            store[removed]
+        assert len(store) == len(participants)
+
+
+def test_topic_with_mapped_store(tmpdir):
+    path = os.path.join(str(tmpdir), "participants")
+    topic_key = generate_topic_key()
+    slave = Topic(topic_key=topic_key)
+
+    with MappedParticipantStore(path) as store:
+        master = Topic(topic_key=topic_key, participants=store)
+        master.add_participant(slave.public_key)
+        store.compact()
+
+    with MappedParticipantStore(path) as store:
+        master = Topic(topic_key=topic_key, participants=store)
+        assert master.decode(slave.encode(b"Hello")) == b"Hello"
+        master.remove_participant(slave.id)
+        assert slave.id not in store
+
+
+def test_mapped_store_torn_write(tmpdir):
+    path = os.path.join(str(tmpdir), "participants")
+    a, b = os.urandom(16), os.urandom(16)
+
+    with MappedParticipantStore(path) as store:
+        store[a] = os.urandom(32)
+    # Simulate a crash in the middle of writing a record.
+    with open(path + ".log", "ab") as outfile:
+        outfile.write(b"+" + os.urandom(20))
+
+    with MappedParticipantStore(path) as store:
+        assert a in store
+        store[b] = os.urandom(32)
+
+    with MappedParticipantStore(path) as store:
+        assert a in store
+        assert b in store
+        assert len(store) == 2
+
+    # Records with an unknown operation are corruption, not removals.
+    with open(path + ".log", "ab") as outfile:
+        outfile.write(b"?" + os.urandom(48))
+    with pytest.raises(ValueError):
+        MappedParticipantStore(path)
+
+
+def test_mapped_store_compact_durability(tmpdir, monkeypatch):
+    path = os.path.join(str(tmpdir), "participants")
+    events = []
+    fsync = os.fsync
+    monkeypatch.setattr(
+        os, "fsync", lambda fd: events.append("fsync") or fsync(fd)
+    )
+    monkeypatch.setattr(
+        store_module, "_replace",
+        lambda source, destination: events.append("replace") or
+        os.rename(source, destination)
+    )
+
+    with MappedParticipantStore(path) as store:
+        store[os.urandom(16)] = os.urandom(32)
+        # A temporary file left by an earlier crash is overwritten.
+        with open(path + ".tmp", "wb") as outfile:
+            outfile.write(b"stale")
+        del events[:]
+        store.compact()
+        assert len(store) == 1
+    # The new file and its directory entry are on disk before the old file
+    # is replaced, and the rename is before the log is emptied.
+    assert events == ["fsync", "fsync", "replace", "fsync"]
+    assert not os.path.exists(path + ".tmp")
@@ -1,12 +1,19 @@
+import io
+import threading
+import weakref
+
 import pytest
 from hypothesis import given
-from hypothesis.strategies import binary
+from hypothesis.strategies import binary, integers, lists
 
-from stringphone import Topic, Message
+from stringphone import Topic, Message, MessageView
 from stringphone import generate_topic_key
 from stringphone.exceptions import (
-    BadSignatureError, IntroductionError, IntroductionReplyError
+    BadSignatureError, IntroductionError, IntroductionReplyError,
+    MalformedMessageError, MissingTopicKeyError, StreamChunkError,
+    UntrustedKeyError
 )
+from stringphone.topic import MESSAGE_UNKNOWN
 
 
 @given(binary())
@@ -105,3 +112,397 @@ def test_discovery(bytestring):
     # Now we can decrypt all messages.
     assert slave.decode(master.encode(bytestring)) == bytestring
     assert master.decode(slave.encode(bytestring)) == bytestring
+
+
+@given(binary())
+def test_verifier_cache(bytestring):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, verifier_cache_size=1)
+    slave1 = Topic(topic_key=topic_key)
+    slave2 = Topic(topic_key=topic_key)
+
+    master.add_participant(slave1.public_key)
+    master.add_participant(slave2.public_key)
+
+    # Evicted verifiers are reconstructed on demand.
+    assert master.decode(slave1.encode(bytestring)) == bytestring
+    assert master.decode(slave2.encode(bytestring)) == bytestring
+
+    # Removed participants are no longer trusted.
+    master.remove_participant(slave1.id)
+    with pytest.raises(UntrustedKeyError):
+        master.decode(slave1.encode(bytestring))
+
+
+@given(binary())
+def test_decode_many(bytestring):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    stranger = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+
+    results = master.decode_many([
+        slave.encode(bytestring),
+        stranger.encode(bytestring),
+        slave.construct_intro(),
+        master.encode(bytestring),
+        slave.encode(bytestring),
+    ])
+    assert results[0] == bytestring
+    assert isinstance(results[1], UntrustedKeyError)
+    assert isinstance(results[2], IntroductionError)
+    assert results[3] is None
+    assert results[4] == bytestring
+
+
+@given(lists(binary(), max_size=10))
+def test_encode_many(bytestrings):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+
+    assert master.decode_many(slave.encode_many(bytestrings)) == bytestrings
+
+
+@given(binary())
+def test_message_view(bytestring):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+
+    encoded = slave.encode(bytestring)
+    view = MessageView(bytearray(encoded))
+    message = Message(encoded)
+    assert isinstance(view.ciphertext, memoryview)
+    assert view.ciphertext == message.ciphertext
+    assert view.sender_id == message.sender_id == slave.id
+    assert master.decode(view) == bytestring
+
+    intro = MessageView(bytearray(slave.construct_intro()))
+    reply = MessageView(bytearray(master.construct_reply(intro)))
+    assert reply.recipient_id == slave.id
+
+
+def test_malformed_messages():
+    topic = Topic(topic_key=generate_topic_key())
+    for message in (b"s" + b"\0" * 10, b"i" + b"\0" * 32, b"r"):
+        # Messages are validated when their fields are first read.
+        with pytest.raises(MalformedMessageError):
+            Message(message).type
+        with pytest.raises(MalformedMessageError):
+            Message(message).sender_id
+        with pytest.raises(MalformedMessageError):
+            topic.decode(message)
+
+    with pytest.raises(MalformedMessageError):
+        topic.decode(b"unknown")
+    assert Message(b"unknown").type == MESSAGE_UNKNOWN
+    assert isinstance(topic.decode_many([b"s"])[0], MalformedMessageError)
+
+
+@given(binary(), integers(min_value=1, max_value=16))
+def test_streaming(bytestring, chunk_size):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+
+    chunks = list(slave.encode_stream(io.BytesIO(bytestring), chunk_size))
+    assert b"".join(master.decode_stream(chunks)) == bytestring
+
+    pieces = [bytestring[:3], bytestring[3:]]
+    chunks = list(slave.encode_stream(pieces, chunk_size))
+    assert b"".join(master.decode_stream(chunks)) == bytestring
+
+    with pytest.raises(StreamChunkError):
+        master.decode(chunks[0])
+
+    # Truncated streams are detected.
+    with pytest.raises(MalformedMessageError):
+        list(master.decode_stream(chunks[:-1]))
+
+    # Reordered streams are detected.
+    if len(chunks) > 1:
+        with pytest.raises(MalformedMessageError):
+            list(master.decode_stream(chunks[::-1]))
+
+
+def test_self_echo_events():
+    events = []
+    topic = Topic(
+        topic_key=generate_topic_key(),
+        event_callback=lambda event, message: events.append(event)
+    )
+    assert topic.decode(topic.encode(b"Hello")) is None
+    assert topic.decode(topic.construct_intro()) is None
+    stranger = Topic(topic_key=topic.topic_key)
+    assert topic.decode(
+        stranger.encode(b"Hello"), ignore_untrusted=True
+    ) is None
+    assert events == ["self_echo", "self_echo", "untrusted_dropped"]
+
+
+def test_should_process():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, duplicate_cache_size=16)
+    slave = Topic(topic_key=topic_key)
+    stranger = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+
+    message = slave.encode(b"Hello")
+    assert master.should_process(message)
+    assert master.should_process(bytearray(message))
+    assert not master.should_process(stranger.encode(b"Hello"))
+    assert not master.should_process(master.encode(b"Hello"))
+    assert not master.should_process(b"unknown")
+    assert master.should_process(stranger.construct_intro())
+
+    # Duplicates are dropped once the original has been decoded.
+    assert master.decode(message) == b"Hello"
+    assert not master.should_process(message)
+    assert master.decode(message) is None
+
+
+def test_snapshot_restore():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, replay_window=16)
+    slave = Topic(topic_key=topic_key, replay_window=16)
+    master.add_participant(slave.public_key)
+    slave.add_participant(master.public_key)
+    message = slave.encode(b"hello")
+    assert master.decode(message) == b"hello"
+
+    restored = Topic.restore(master.snapshot(), replay_window=16)
+    assert restored.id == master.id
+    assert restored.topic_key == topic_key
+    assert restored.participants() == master.participants()
+    # The replay state survives, so old messages are still rejected.
+    assert restored.decode(message) is None
+    assert restored.decode(slave.encode(b"world")) == b"world"
+    assert slave.decode(restored.encode(b"again")) == b"again"
+
+
+def test_snapshot_pending_introduction():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic()
+    reply = master.construct_reply(slave.construct_intro())
+
+    # The reply to an introduction sent before the restart is still usable.
+    restored = Topic.restore(slave.snapshot())
+    assert restored.topic_key is None
+    assert restored.parse_reply(reply)
+    assert restored.topic_key == topic_key
+
+
+def test_restore_invalid_snapshot():
+    snapshot = Topic(topic_key=generate_topic_key()).snapshot()
+    for invalid in (
+        b"", b"XXXX" + snapshot[4:], snapshot[:-1], snapshot + b"\0"
+    ):
+        with pytest.raises(ValueError):
+            Topic.restore(invalid)
+
+
+def test_key_rotation():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    outsider = Topic(topic_key=topic_key)
+    for topic in (master, slave, outsider):
+        topic.add_participant(master.public_key)
+    master.add_participant(slave.public_key)
+
+    in_flight = slave.encode(b"before")
+    rotation = master.rotate_key()
+    assert master.epoch == 1
+    assert master.topic_key != topic_key
+
+    assert slave.decode(rotation) is None
+    assert slave.epoch == 1
+    assert slave.topic_key == master.topic_key
+    # Replaying the rotation has no effect.
+    assert slave.decode(rotation) is None
+    assert slave.epoch == 1
+
+    # Messages sent before the rotation are still readable.
+    assert master.decode(in_flight) == b"before"
+    assert master.decode(slave.encode(b"after")) == b"after"
+    restored = Topic.restore(master.snapshot())
+    assert restored.epoch == 1
+    assert restored.decode(in_flight, naive=True) == b"before"
+
+    # Participants the rotation wasn't addressed to can't follow it.
+    assert outsider.decode(rotation) is None
+    assert outsider.epoch == 0
+    with pytest.raises(MissingTopicKeyError):
+        outsider.decode(master.encode(b"secret"), naive=True)
+
+    # New participants learn the epoch from the reply.
+    newcomer = Topic()
+    newcomer.parse_reply(master.construct_reply(newcomer.construct_intro()))
+    assert newcomer.epoch == 1
+    assert newcomer.decode(master.encode(b"hi"), naive=True) == b"hi"
+
+
+def test_untrusted_key_rotation():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+
+    rotation = master.rotate_key()
+    with pytest.raises(UntrustedKeyError):
+        slave.decode(rotation, naive=True)
+    assert slave.decode(rotation, ignore_untrusted=True) is None
+    assert slave.topic_key == topic_key
+
+
+def test_streaming_after_key_rotation():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    master.add_participant(slave.public_key)
+    slave.add_participant(master.public_key)
+    slave.decode(master.rotate_key())
+
+    chunks = list(master.encode_stream([b"a" * 10, b"b" * 10], chunk_size=8))
+    assert all(Message(chunk).epoch == 1 for chunk in chunks)
+    assert b"".join(slave.decode_stream(chunks)) == b"a" * 10 + b"b" * 10
+
+
+def test_encoding_during_key_rotation():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key, key_history=1000)
+    master.add_participant(slave.public_key)
+    slave.add_participant(master.public_key)
+
+    rotations = []
+    rotator = threading.Thread(
+        target=lambda: rotations.extend(master.rotate_key() for _ in range(200))
+    )
+    rotator.start()
+    messages = []
+    while rotator.is_alive():
+        messages.append(master.encode(b"payload"))
+    rotator.join()
+
+    for rotation in rotations:
+        slave.decode(rotation)
+    # Every message is tagged with the epoch of the key it was encrypted
+    # with.
+    assert all(slave.decode(message) == b"payload" for message in messages)
+
+
+def test_batch_reply():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    newcomers = [Topic() for _ in range(5)]
+    intros = [newcomer.construct_intro() for newcomer in newcomers]
+    forged = intros[0][:-1] + b"\0"
+
+    reply = master.construct_reply_batch(
+        intros + [intros[1], forged, master.encode(b"hello")]
+    )
+    assert len(reply) == 133 + 88 * len(newcomers)
+    for newcomer in newcomers:
+        with pytest.raises(IntroductionReplyError):
+            newcomer.decode(reply)
+        assert newcomer.parse_reply(reply)
+        assert newcomer.topic_key == topic_key
+
+    outsider = Topic()
+    assert not outsider.parse_reply(reply)
+    assert master.construct_reply_batch([forged]) is None
+
+    tampered = reply[:-1] + bytes(bytearray([reply[-1] ^ 1]))
+    with pytest.raises(BadSignatureError):
+        Topic().parse_reply(tampered)
+
+
+@given(lists(binary(), min_size=1, max_size=20))
+def test_batch_signing(bytestrings):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, replay_window=64)
+    slave = Topic(topic_key=topic_key, duplicate_cache_size=64)
+    slave.add_participant(master.public_key)
+
+    messages = master.encode_many(bytestrings, batch_sign=True)
+    # Every message can be decoded on its own, in any order.
+    assert [
+        slave.decode(message) for message in reversed(messages)
+    ] == bytestrings[::-1]
+    # The messages share a signature, but are not duplicates of each other.
+    assert slave.decode(messages[0]) is None
+
+
+def test_batch_signing_tampering():
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key)
+    slave = Topic(topic_key=topic_key)
+    slave.add_participant(master.public_key)
+
+    first, second = master.encode_many([b"first", b"second"], batch_sign=True)
+    # Swapping the ciphertexts of two messages invalidates both proofs.
+    split = len(first) - len(b"first") - 40
+    with pytest.raises(BadSignatureError):
+        slave.decode(first[:split] + second[split:])
+    forged = Topic(topic_key=topic_key).encode_many([b"x"], batch_sign=True)[0]
+    with pytest.raises(BadSignatureError):
+        slave.decode(forged[:65] + first[65:])
+    assert slave.decode(second) == b"second"
+    # A copy with a different signature isn't trusted because the root has
+    # been seen before.
+    tampered = first[:1] + bytes(bytearray([first[1] ^ 1])) + first[2:]
+    with pytest.raises(BadSignatureError):
+        slave.decode(tampered)
+    assert slave.decode(first) == b"first"
+
+    deduplicating = Topic(topic_key=topic_key, duplicate_cache_size=8)
+    deduplicating.add_participant(master.public_key)
+    assert deduplicating.decode(first) == b"first"
+    with pytest.raises(BadSignatureError):
+        deduplicating.decode(tampered)
+    assert deduplicating.decode(first) is None
+
+
+@given(binary())
+def test_mac_authentication(bytestring):
+    topic_key = generate_topic_key()
+    master = Topic(topic_key=topic_key, mac_authentication=True)
+    slave = Topic(topic_key=topic_key, mac_authentication=True)
+    slave.add_participant(master.public_key)
+    master.add_participant(slave.public_key)
+
+    message = master.encode(bytestring)
+    assert Message(message).type == b"a"
+    assert slave.decode(message) == bytestring
+    # Both kinds of messages are accepted on the same topic.
+    signing = Topic(topic_key=topic_key)
+    master.add_participant(signing.public_key)
+    assert master.decode(signing.encode(bytestring)) == bytestring
+
+    # Topics that didn't opt in don't trust authenticated messages, as any
+    # key holder can forge them.
+    default = Topic(topic_key=topic_key)
+    default.add_participant(master.public_key)
+    with pytest.raises(UntrustedKeyError):
+        default.decode(message)
+
+    tampered = message[:-1] + bytes(bytearray([message[-1] ^ 1]))
+    with pytest.raises(BadSignatureError):
+        slave.decode(tampered)
+    with pytest.raises(BadSignatureError):
+        slave.decode(message[:1] + b"\0" * 64 + message[65:])
+
+
+def test_topic_attributes_and_weak_references():
+    topic = Topic()
+    topic.name = "sensors"
+    assert topic.name == "sensors"
+    reference = weakref.ref(topic)
+    assert reference() is topic